@@ -0,0 +1,224 @@
+import argparse, csv, json, multiprocessing, os, re, sys, tempfile, time
+
+from csa import ContactSurfaceArea, SOFT_THRESHOLD
+from cache import ResultCache
+from instrumentation import Instrumentation, JsonTraceSink, ComputationCancelled
+from executor import ComputeExecutor, ComputationTimeout
+from distance import DISTANCE_ENGINES, DEFAULT_DISTANCE_ENGINE
+
+FIELDS = ["id", "tumor", "organ", "csa", "tumor_area", "tumor_volume", "threshold", "disconnected", "penetration_area", "penetration_depth", "seconds", "error"]
+
+def natural_key(text):
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", text)]
+
+#Every folder holding exactly one *tumor.stl and one *organ.stl file is a case, named after the folder
+def find_cases(directory):
+    cases = []
+    for root, dirs, files in os.walk(directory):
+        tumors = [f for f in files if f.lower().endswith("tumor.stl")]
+        organs = [f for f in files if f.lower().endswith("organ.stl")]
+        if len(tumors) == 1 and len(organs) == 1:
+            case_id = os.path.relpath(root, directory).replace(os.sep, "/")
+            if case_id == ".":
+                case_id = os.path.basename(os.path.abspath(root))
+            cases.append({"id": case_id, "tumor": os.path.join(root, tumors[0]), "organ": os.path.join(root, organs[0])})
+    return sorted(cases, key=lambda case: natural_key(case["id"]))
+
+#Manifest: CSV with tumor and organ columns (id optional) or a JSON list of objects with the same keys.
+#Relative paths are relative to the manifest.
+def read_manifest(path):
+    with open(path, newline="") as f:
+        if path.lower().endswith(".json"):
+            entries = json.load(f)
+        else:
+            entries = list(csv.DictReader(f))
+
+    base = os.path.dirname(os.path.abspath(path))
+    cases = []
+    for i, entry in enumerate(entries):
+        case = {"id": str(entry.get("id") or i+1)}
+        for key in ("tumor", "organ"):
+            if not entry.get(key):
+                raise ValueError("Manifest entry %s has no %s file" % (case["id"], key))
+            case[key] = os.path.join(base, entry[key])
+        cases.append(case)
+    return cases
+
+def load_cases(source):
+    if os.path.isdir(source):
+        return find_cases(source)
+    return read_manifest(source)
+
+#instrumentation is given by the ComputeExecutor worker running the case, it carries the
+#cancellation of timed out cases
+def run_case(case, options, instrumentation=None):
+    row = {"id": case["id"], "tumor": case["tumor"], "organ": case["organ"], "error": ""}
+    start = time.perf_counter()
+    try:
+        cache = ResultCache(options["cache"]) if options["cache"] is not None else None
+        csa = ContactSurfaceArea(case["tumor"], "tumor", case["organ"], "organ", distance_engine=options["engine"], search_radius=options["search_radius"], cache=cache, signed=options["signed"])
+        if instrumentation is None:
+            instrumentation = Instrumentation(ContactSurfaceArea.STAGES)
+        if options["trace"] is not None:
+            os.makedirs(options["trace"], exist_ok=True)
+            instrumentation.add_sink(JsonTraceSink(os.path.join(options["trace"], re.sub(r"[^\w.-]", "_", case["id"]) + ".jsonl")))
+        csa.compute(instrumentation=instrumentation)
+
+        if(csa.get_name_obj_p() == "tumor"):
+            area = csa.get_area_obj_p()
+            volume = csa.get_volume_obj_p()
+        else:
+            area = csa.get_area_obj_q()
+            volume = csa.get_volume_obj_q()
+
+        row.update({
+            "csa": csa.get_csa(),
+            "tumor_area": area,
+            "tumor_volume": volume,
+            "threshold": csa.get_threshold(),
+            "disconnected": csa.get_number_of_disconnected(),
+        })
+        if csa.is_signed():
+            row.update({"penetration_area": csa.get_penetration_area(), "penetration_depth": csa.get_penetration_depth()})
+    except ComputationCancelled:
+        raise
+    except Exception as e:
+        row["error"] = "%s: %s" % (type(e).__name__, e)
+    row["seconds"] = time.perf_counter() - start
+    return row
+
+#Rows are appended and flushed as soon as each case finishes: .csv files get CSV rows,
+#anything else one JSON object per line. On resume the file is rewritten with only the
+#completed rows, the last one of each case, before the new rows are appended.
+class ResultWriter:
+    def __init__(self, path, resume=False, fields=FIELDS):
+        self.__path = path
+        self.__json = not path.lower().endswith(".csv")
+        self.__fields = fields
+        kept = self.__read_completed() if resume else []
+        self.__completed = {str(row["id"]) for row in kept}
+
+        self.__rewrite(kept)
+        self.__file = open(path, "a", newline="")
+        if not self.__json:
+            self.__writer = csv.DictWriter(self.__file, fieldnames=fields)
+
+    #Last row of each case that finished without errors in a previous run. Rows cut off
+    #mid-write do not parse or lack the csa or error field, they count as not completed.
+    def __read_completed(self):
+        if not os.path.exists(self.__path):
+            return []
+        with open(self.__path, newline="") as f:
+            if self.__json:
+                rows = []
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        pass
+            else:
+                rows = list(csv.DictReader(f))
+        completed = {}
+        for row in rows:
+            if isinstance(row, dict) and row.get("csa") not in (None, "") and row.get("error") == "":
+                completed.pop(str(row["id"]), None)
+                completed[str(row["id"])] = row
+        return list(completed.values())
+
+    #Written to a temporary file first, so that an interrupted rewrite keeps the old rows
+    def __rewrite(self, rows):
+        handle, temporary = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.__path)))
+        try:
+            with os.fdopen(handle, "w", newline="") as f:
+                if self.__json:
+                    for row in rows:
+                        f.write(json.dumps(row) + "\n")
+                else:
+                    writer = csv.DictWriter(f, fieldnames=self.__fields, extrasaction="ignore")
+                    writer.writeheader()
+                    writer.writerows(rows)
+            os.replace(temporary, self.__path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def get_completed(self):
+        return self.__completed
+
+    def write(self, row):
+        if self.__json:
+            self.__file.write(json.dumps(row) + "\n")
+        else:
+            self.__writer.writerow(row)
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+#Row of a case whose job did not return one (timed out, worker lost)
+def failed_row(case, error, seconds):
+    return {"id": case["id"], "tumor": case["tumor"], "organ": case["organ"], "error": "%s: %s" % (type(error).__name__, error), "seconds": seconds}
+
+def executor_rows(cases, options, workers, timeout):
+    with ComputeExecutor(workers) as executor:
+        jobs = {}
+        for case in cases:
+            jobs[executor.submit(run_case, case, options, timeout=timeout, forward_events=False)] = case
+        for job in executor.as_completed(list(jobs)):
+            try:
+                yield job.result()
+            except Exception as e:
+                yield failed_row(jobs[job], e, job.get_timeout() if isinstance(e, ComputationTimeout) else 0.0)
+
+def run_batch(cases, output, workers=None, engine=None, search_radius=None, resume=False, log=None, cache=None, trace=None, timeout=None, signed=False):
+    writer = ResultWriter(output, resume)
+    pending = [case for case in cases if case["id"] not in writer.get_completed()]
+    options = {"engine": engine, "search_radius": search_radius, "cache": cache, "trace": trace, "signed": signed}
+
+    failed = 0
+    try:
+        if workers == 1 and timeout is None:
+            rows = (run_case(case, options) for case in pending)
+        else:
+            rows = executor_rows(pending, options, workers, timeout)
+
+        for done, row in enumerate(rows, 1):
+            writer.write(row)
+            if row["error"]:
+                failed += 1
+            if log is not None:
+                status = row["error"] if row["error"] else "CSA %.4f" % row["csa"]
+                log("[%d/%d] %s: %s (%.1f s)" % (done, len(pending), row["id"], status, row["seconds"]))
+    finally:
+        writer.close()
+    return len(pending), failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute the contact surface area of many tumor/organ pairs.")
+    parser.add_argument("source", help="folder searched for *tumor.stl/*organ.stl pairs, or a CSV/JSON manifest with tumor and organ columns")
+    parser.add_argument("-o", "--output", default="results.csv", help="results file, CSV if it ends in .csv, JSON lines otherwise")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--engine", choices=sorted(DISTANCE_ENGINES), default=DEFAULT_DISTANCE_ENGINE, help="distance engine")
+    parser.add_argument("--search-radius", type=float, default=None, help="faces farther than this are out of contact, at least the soft threshold of the fit (%d)" % SOFT_THRESHOLD)
+    parser.add_argument("--signed", action="store_true", help="report the faces inside the organ as penetration area and depth")
+    parser.add_argument("--cache", default=None, metavar="DIR", help="reuse and store results in this cache folder")
+    parser.add_argument("--trace", default=None, metavar="DIR", help="write the stage and progress events of each case as JSON lines in this folder")
+    parser.add_argument("--timeout", type=float, default=None, metavar="SECONDS", help="stop a case running longer than this and report it as failed")
+    parser.add_argument("--resume", action="store_true", help="keep the existing results and skip the cases already completed")
+    args = parser.parse_args(argv)
+    if args.search_radius is not None and args.search_radius < SOFT_THRESHOLD:
+        parser.error("--search-radius must be at least the soft threshold (%d)" % SOFT_THRESHOLD)
+
+    cases = load_cases(args.source)
+    if not cases:
+        parser.error("no cases found in " + args.source)
+
+    log = lambda message: print(message, file=sys.stderr, flush=True)
+    total, failed = run_batch(cases, args.output, args.workers, args.engine, args.search_radius, args.resume, log, args.cache, args.trace, args.timeout, args.signed)
+    log("%d cases computed, %d failed, %d skipped" % (total, failed, len(cases)-total))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
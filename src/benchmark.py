@@ -0,0 +1,163 @@
+import argparse, json, os, platform, sys, time, tracemalloc
+import numpy as np
+
+from csa import ContactSurfaceArea, SOFT_THRESHOLD
+from batch import find_cases
+from distance import DISTANCE_ENGINES, DEFAULT_DISTANCE_ENGINE
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmark")
+
+#The ground truth CSA is the number in front of the file names, e.g. 353.429_tumor.stl
+def ground_truth(path):
+    return float(os.path.basename(path).split("_")[0])
+
+MEMORY_NOTE = ("peak_bytes is the peak of the allocations traced by tracemalloc in this process: it misses "
+               "the native memory of cKDTree (kdtree and surface engines) and the bruteforce worker processes, "
+               "so it is not the real peak for those engines")
+
+#Result, wall time and peak traced memory (NumPy allocations included) of a function call
+def measure(function):
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    value = function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - before
+    return value, {"seconds": seconds, "peak_bytes": int(max(peak, 0))}
+
+def run_case(case, engine=None, search_radius=None, signed=False):
+    stages = {}
+    csa, stages["load"] = measure(lambda: ContactSurfaceArea(case["tumor"], "tumor", case["organ"], "organ", distance_engine=engine, search_radius=search_radius, signed=signed))
+
+    for stage in ContactSurfaceArea.STAGES:
+        _, stages[stage] = measure(csa.stage_function(stage))
+
+    real = ground_truth(case["tumor"])
+    estimated = csa.get_csa()
+    result = {
+        "id": case["id"],
+        "real": real,
+        "estimated": estimated,
+        "error": estimated - real,
+        "relative_error": (estimated - real)/real,
+        "threshold": csa.get_threshold(),
+        "seconds": sum(stage["seconds"] for stage in stages.values()),
+        "peak_bytes": max(stage["peak_bytes"] for stage in stages.values()),
+        "stages": stages,
+    }
+    if signed:
+        result.update({"penetration_area": csa.get_penetration_area(), "penetration_depth": csa.get_penetration_depth()})
+    return result
+
+def summarize(cases):
+    absolute = np.abs([case["error"] for case in cases])
+    relative = np.abs([case["relative_error"] for case in cases])
+    stages = {}
+    for stage in ["load"] + list(ContactSurfaceArea.STAGES):
+        stages[stage] = {
+            "seconds": float(sum(case["stages"][stage]["seconds"] for case in cases)),
+            "peak_bytes": int(max(case["stages"][stage]["peak_bytes"] for case in cases)),
+        }
+    return {
+        "cases": len(cases),
+        "mean_absolute_error": float(np.mean(absolute)),
+        "max_absolute_error": float(np.max(absolute)),
+        "mean_relative_error": float(np.mean(relative)),
+        "max_relative_error": float(np.max(relative)),
+        "seconds": float(sum(case["seconds"] for case in cases)),
+        "stages": stages,
+    }
+
+def run_benchmark(dataset, engine=None, search_radius=None, log=None, signed=False):
+    cases = find_cases(dataset)
+    results = []
+    # untimed run of the first case, so that the lazy imports (scipy) are not timed in it
+    if cases:
+        run_case(cases[0], engine, search_radius, signed)
+    tracemalloc.start()
+    try:
+        for case in cases:
+            result = run_case(case, engine, search_radius, signed)
+            results.append(result)
+            if log is not None:
+                log("%s: real %.4f estimated %.4f error %+.2f%% (%.2f s)" % (result["id"], result["real"], result["estimated"], 100*result["relative_error"], result["seconds"]))
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "engine": engine if engine is not None else DEFAULT_DISTANCE_ENGINE,
+        "search_radius": search_radius,
+        "signed": signed,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "memory_note": MEMORY_NOTE,
+        "summary": summarize(results),
+        "cases": results,
+    }
+
+#Same layout as benchmark/results.csv: tab separated, four truncated decimals with a decimal comma
+def write_results_csv(report, path):
+    number = lambda value: ("%.4f" % (np.trunc(value*1e4 + 1e-6)/1e4)).replace(".", ",")
+    with open(path, "w", newline="") as f:
+        f.write("ID\tReal CSA\tEstimated CSA\t\n")
+        for case in report["cases"]:
+            f.write("%s\t%s\t%s\t\n" % (case["id"], number(case["real"]), number(case["estimated"])))
+
+#Regressions of a report against a baseline report: cases whose CSA moved by more than
+#tolerance (relative) and stages slower than slowdown times the baseline
+def compare(report, baseline, tolerance=1e-3, slowdown=1.5, minimum_seconds=0.05):
+    problems = []
+    previous = {case["id"]: case for case in baseline["cases"]}
+    for case in report["cases"]:
+        if case["id"] not in previous:
+            continue
+        old = previous[case["id"]]
+        if abs(case["estimated"] - old["estimated"]) > tolerance*abs(old["estimated"]):
+            problems.append("%s: CSA %.4f, baseline %.4f" % (case["id"], case["estimated"], old["estimated"]))
+
+    for stage, timing in report["summary"]["stages"].items():
+        old = baseline["summary"]["stages"].get(stage)
+        if old is not None and timing["seconds"] > minimum_seconds and timing["seconds"] > slowdown*old["seconds"]:
+            problems.append("%s stage: %.3f s, baseline %.3f s" % (stage, timing["seconds"], old["seconds"]))
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accuracy and speed benchmark of the contact surface area over the benchmark dataset.")
+    parser.add_argument("dataset", nargs="?", default=DEFAULT_DATASET, help="folder of cases named <real CSA>_tumor.stl/<real CSA>_organ.stl")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON report")
+    parser.add_argument("--results-csv", default=None, help="also write the Real/Estimated table in the results.csv layout")
+    parser.add_argument("--engine", choices=sorted(DISTANCE_ENGINES), default=DEFAULT_DISTANCE_ENGINE, help="distance engine")
+    parser.add_argument("--search-radius", type=float, default=None, help="faces farther than this are out of contact, at least the soft threshold of the fit (%d)" % SOFT_THRESHOLD)
+    parser.add_argument("--signed", action="store_true", help="signed distance mode, faces inside the organ counted as penetration")
+    parser.add_argument("--compare", default=None, metavar="BASELINE", help="JSON report to check for accuracy and speed regressions")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="allowed relative CSA change against the baseline")
+    parser.add_argument("--slowdown", type=float, default=1.5, help="allowed stage time ratio against the baseline")
+    args = parser.parse_args(argv)
+    if args.search_radius is not None and args.search_radius < SOFT_THRESHOLD:
+        parser.error("--search-radius must be at least the soft threshold (%d)" % SOFT_THRESHOLD)
+
+    log = lambda message: print(message, file=sys.stderr, flush=True)
+    report = run_benchmark(args.dataset, args.engine, args.search_radius, log, args.signed)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.results_csv is not None:
+        write_results_csv(report, args.results_csv)
+
+    summary = report["summary"]
+    log("%d cases, mean error %.2f%%, max error %.2f%%, %.2f s" % (summary["cases"], 100*summary["mean_relative_error"], 100*summary["max_relative_error"], summary["seconds"]))
+    for stage, timing in summary["stages"].items():
+        log("  %-12s %8.3f s  peak %8.1f MB" % (stage, timing["seconds"], timing["peak_bytes"]/2**20))
+    log("  " + report["memory_note"])
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            problems = compare(report, json.load(f), args.tolerance, args.slowdown)
+        for problem in problems:
+            log("REGRESSION " + problem)
+        return 1 if problems else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,11 +7,11 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=['vtkmodules','vtkmodules.all','vtkmodules.qt.QVTKRenderWindowInteractor','vtkmodules.util','vtkmodules.util.numpy_support'],
+    hiddenimports=['vtkmodules.vtkCommonCore','vtkmodules.vtkCommonDataModel','vtkmodules.vtkFiltersCore','vtkmodules.vtkRenderingCore','vtkmodules.vtkRenderingOpenGL2','vtkmodules.vtkInteractionStyle','vtkmodules.qt.QVTKRenderWindowInteractor','vtkmodules.util.numpy_support'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['vtk','vtkmodules.all','networkx'],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
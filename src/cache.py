@@ -0,0 +1,104 @@
+import hashlib, os, tempfile, zipfile
+import numpy as np
+
+DEFAULT_MAX_BYTES = 512*1024*1024
+
+def default_cache_directory():
+    if os.name == "nt" and os.environ.get("LOCALAPPDATA"):
+        return os.path.join(os.environ["LOCALAPPDATA"], "csa", "cache")
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "csa")
+
+_file_hashes = {}
+
+#SHA-256 of the file content, remembered as long as the file size and modification time do not change
+def file_hash(path, chunk_size=1 << 20):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                sha.update(block)
+        _file_hashes[key] = sha.hexdigest()
+    return _file_hashes[key]
+
+#On-disk cache with one .npz file per entry. Entries are looked up by a key built from any
+#strings (file hashes, parameters); the least recently used ones are removed once the
+#cache grows above max_bytes.
+class ResultCache:
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.__directory = directory if directory is not None else default_cache_directory()
+        self.__max_bytes = max_bytes
+
+    def get_directory(self):
+        return self.__directory
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256("\n".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.__directory, key + ".npz")
+
+    #Dictionary of the stored arrays, None when the entry is missing. An entry that cannot be
+    #read or lacks one of the required arrays is deleted and reported as missing.
+    def get(self, key, required=()):
+        path = self.__path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                entry = {name: data[name] for name in data.files}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            entry = None
+        if entry is None or any(name not in entry for name in required):
+            self.remove(key)
+            return None
+        os.utime(path)
+        return entry
+
+    def remove(self, key):
+        try:
+            os.remove(self.__path(key))
+        except OSError:
+            pass
+
+    def put(self, key, **arrays):
+        os.makedirs(self.__directory, exist_ok=True)
+        # written under a .tmp name, that evict and clear leave alone, then renamed
+        handle, temporary = tempfile.mkstemp(suffix=".tmp", dir=self.__directory)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(temporary, self.__path(key))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.__directory):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.__directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.__max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.__directory, name))
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        if os.path.isdir(self.__directory):
+            for name in os.listdir(self.__directory):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.__directory, name))
@@ -0,0 +1,64 @@
+import numpy as np
+
+from stl_io import chunks, CHUNK_SIZE
+
+#Order preserving codes of the float32 coordinates of the corners (n,3,3), one 12 bytes key
+#per corner: the codes are big-endian so that comparing the bytes of two keys compares the
+#vertices lexicographically, as np.unique(axis=0) does
+def _vertex_keys(triangles):
+    # adding 0.0 turns -0.0 into 0.0 so that both weld together
+    bits = (np.asarray(triangles, dtype=np.float32).reshape(-1, 3) + np.float32(0.0)).view(np.uint32)
+    codes = np.where(bits >> 31, ~bits, bits | np.uint32(0x80000000)).astype('>u4')
+    return codes.view('V12').ravel()
+
+def _key_vertices(keys):
+    codes = keys.view('>u4').reshape(-1, 3).astype(np.uint32)
+    return np.where(codes >> 31, codes & np.uint32(0x7fffffff), ~codes).view(np.float32)
+
+#Merge the vertices shared by the triangles (n,3,3): returns the unique vertices, sorted, and
+#for each face the int32 ids of its three vertices. Vertices are welded on exact coordinates.
+#The triangles are read chunk_size at a time, first to grow the table of unique vertices,
+#then to look up the ids of their corners.
+def weld_vertices(triangles, chunk_size=CHUNK_SIZE):
+    n = triangles.shape[0]
+    table = np.zeros(0, dtype='V12')
+    for start, stop in chunks(n, chunk_size):
+        table = np.unique(np.concatenate((table, _vertex_keys(triangles[start:stop]))))
+
+    faces = np.empty((n, 3), dtype=np.int32)
+    for start, stop in chunks(n, chunk_size):
+        faces[start:stop] = np.searchsorted(table, _vertex_keys(triangles[start:stop])).reshape(-1, 3)
+    return _key_vertices(table), faces
+
+#Connected components of the faces selected by face_mask, two faces being connected
+#when they share a vertex. Returns one array of face ids per component, components
+#ordered by their lowest face id. progress, if given, is called with the steps done out of 3.
+def face_components(faces, face_mask, number_of_vertices, progress=None):
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    if progress is None:
+        progress = lambda done, total: None
+
+    selected = np.nonzero(face_mask)[0]
+    if selected.shape[0] == 0:
+        progress(3, 3)
+        return []
+
+    corners = faces[selected]
+    rows = np.concatenate((corners[:,0], corners[:,1]))
+    cols = np.concatenate((corners[:,1], corners[:,2]))
+    graph = coo_matrix((np.ones(rows.shape[0], dtype=np.int8), (rows, cols)), shape=(number_of_vertices, number_of_vertices))
+    progress(1, 3)
+    _, vertex_labels = connected_components(graph, directed=False)
+    progress(2, 3)
+
+    labels = vertex_labels[corners[:,0]]
+    _, first, labels = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    labels = order[labels]
+
+    sorting = np.argsort(labels, kind='stable')
+    bounds = np.cumsum(np.bincount(labels))[:-1]
+    components = np.split(selected[sorting], bounds)
+    progress(3, 3)
+    return components
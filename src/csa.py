@@ -1,79 +1,104 @@
-from stl import mesh
 import numpy as np
-import vtk
-import networkx as nx
-import multiprocessing
-
+from distance import get_distance_engine, engine_signature, engine_name, inside_surface
+from cache import file_hash
+from instrumentation import Instrumentation
+from connectivity import weld_vertices, face_components
+from stl_io import read_stl, triangle_properties
+from result_file import pack_result, unpack_result, write_result, read_result
+
+#Triangle mesh read once from an STL file and kept in welded form: unique vertices,
+#int32 vertex ids per face. NumPy and VTK share the arrays.
+#Binary files are memory mapped and the per-face centroids, normals and areas are
+#computed chunk by chunk straight from the file records.
 class Mesh3D:
     def __init__(self, path, name):
         self.__name = name
         self.__path = path
-        self.__mesh = mesh.Mesh.from_file(self.__path)
-        self.__dim = self.__mesh.v0.shape[0]
-     
-    def mesh_volume(self):
-        reader = vtk.vtkSTLReader()
-        reader.SetFileName(self.__path)
-        reader.Update()
-        object = reader.GetOutput()
-
-        # Compute the tumor volume using vtkMassProperties
-        mass_properties = vtk.vtkMassProperties()
-        mass_properties.SetInputData(object)
-        mass_properties.Update()
-        return mass_properties.GetVolume()
-
-    #Compute Area of a Specifi Polygon in the Tumor Mesh - Shoelace Formula
-    def __polygon_area(self,v0,v1,v2):
-        points = np.array([v0,v1,v2])
-
-        #Projection of the three verticies on a plane
-        u = points[1]-points[0]
-        v = points[2]-points[0]
-        
-        # n is the vector perpendicular to the plane containing u and v
-        n = np.cross(u,v)
-        n /= np.sqrt(np.sum(n**2)) # vector normalization
-
-        x = np.array([1,0,0])
 
-        # if n and x are parallel change x
-        if (np.cross(x,n)==0).all():
-            x = np.array([0,0,1])
-
-        # projection of x onto the plane containing u and v
-        x = x - np.dot(x,n)*n
-        x /= np.sqrt(np.sum(x**2)) # vector normalization
-        y = np.cross(n,x) # y is perpendicular to n and x
-
-        points_p = np.empty([np.shape(points)[1],2])
-        for i in range(np.shape(points)[1]):
-            points_p[i,0] = np.dot(points[i],x)
-            points_p[i,1] = np.dot(points[i],y)
+        triangles = read_stl(self.__path)['vectors']
+        self.__centroids, self.__normals, self.__face_areas = triangle_properties(triangles)
+        self.__vertices, self.__faces = weld_vertices(triangles)
+        self.__dim = self.__faces.shape[0]
+        self.__metrics = None
+
+    #Mesh rebuilt from its welded vertices and faces, e.g. those of a saved result, without
+    #reading the STL file. metrics, if given, are the ones of a previous metrics() call.
+    @classmethod
+    def from_arrays(cls, vertices, faces, name, path=None, metrics=None):
+        mesh = cls.__new__(cls)
+        mesh.__name = name
+        mesh.__path = path
+        mesh.__centroids, mesh.__normals, mesh.__face_areas = triangle_properties(vertices[faces])
+        mesh.__vertices = vertices
+        mesh.__faces = faces
+        mesh.__dim = faces.shape[0]
+        mesh.__metrics = metrics
+        return mesh
+
+    #Volume enclosed by the faces by the divergence theorem, sum of the signed tetrahedra (0, v0, v1, v2)
+    def mesh_volume(self):
+        return self.metrics()["volume"]
+
+    #Volume, area, bounding box and size of the mesh, computed once
+    def metrics(self):
+        if self.__metrics is None:
+            v0, v1, v2 = (self.__vertices[self.__faces[:,i]].astype(np.float64) for i in range(3))
+            volume = abs(np.einsum('ij,ij->', v0, np.cross(v1, v2)))/6
+            self.__metrics = {
+                "name": self.__name,
+                "faces": int(self.__dim),
+                "vertices": int(self.__vertices.shape[0]),
+                "area": float(np.sum(self.__face_areas)),
+                "volume": float(volume),
+                "bbox_min": [float(x) for x in np.amin(self.__vertices, axis=0, initial=np.inf)],
+                "bbox_max": [float(x) for x in np.amax(self.__vertices, axis=0, initial=-np.inf)],
+            }
+        return self.__metrics
+
+    #vtkPolyData viewing the vertex and face arrays without copies, restricted to some faces if given.
+    #points, the vtkPoints of another polydata of this mesh, is shared instead of wrapping the vertices again.
+    def polydata(self, indexes=None, points=None):
+        from rendering import mesh_polydata
+        faces = self.__faces if indexes is None else self.__faces[np.asarray(indexes, dtype=np.intp)]
+        return mesh_polydata(self.__vertices, faces, points)
+
+    #Area of every triangle as half the norm of the cross product of two edges
+    def face_areas(self):
+        return self.__face_areas
+
+    def get_centroids(self):
+        return self.__centroids
+
+    #Unit normal of every face from its vertex winding, used by the inside test of the signed mode
+    def get_normals(self):
+        return self.__normals
+
+    #indexes can be face ids or a boolean mask over the faces
+    def mesh_area(self, indexes):
+        indexes = np.asarray(indexes)
+        if indexes.dtype != bool:
+            indexes = indexes.astype(np.intp)
+        return float(np.sum(self.face_areas()[indexes]))
 
-        #Computation of the are with the Shoelace formula
-        area = 0
+    #Corners of the faces, same layout as numpy-stl
+    @property
+    def v0(self):
+        return self.__vertices[self.__faces[:,0]]
 
-        for i in range(np.shape(points)[1]-1):
-            area += points_p[i,0]*points_p[i+1,1]
+    @property
+    def v1(self):
+        return self.__vertices[self.__faces[:,1]]
 
-        for i in range(np.shape(points)[1]-1):
-            area -= points_p[i+1,0]*points_p[i,1]
+    @property
+    def v2(self):
+        return self.__vertices[self.__faces[:,2]]
 
-        area += points_p[-1,0]*points_p[0,1]
-        area -= points_p[0,0]*points_p[-1,1]
-        area = abs(area)/2
+    def get_vertices(self):
+        return self.__vertices
 
-        return float(area)
-    
-    def mesh_area(self, indexes):
-        area_tot = 0
-        for i in range(0,indexes.shape[0]):
-            area_tot += self.__polygon_area(self.__mesh.v0[int(indexes[i])],self.__mesh.v1[int(indexes[i])],self.__mesh.v2[int(indexes[i])])
-        return area_tot
+    def get_faces(self):
+        return self.__faces
 
-    def get_mesh(self):
-        return self.__mesh
     
     def get_dim(self):
         return self.__dim
@@ -84,173 +109,472 @@ class Mesh3D:
     def get_name(self):
         return self.__name
 
-def min_distance(args):
-        obj_p, obj_q, i = args
-        return np.amin(np.linalg.norm(obj_q-obj_p[i,:],axis=1))
+#Best split of the sorted distances in two linear segments, scored as the sum of the
+#residual norms of the two least squares fits. Prefix sums of x, y, xy and y^2 give
+#the residuals of every split in a single pass.
+def find_threshold(data_to_fit, samples=None):
+    if samples is not None and data_to_fit.shape[0] > samples:
+        picked = np.round(np.linspace(0, data_to_fit.shape[0]-1, samples)).astype(np.intp)
+        data_to_fit = data_to_fit[picked]
+
+    n = data_to_fit.shape[0]
+    distance = np.empty(n)
+    distance[:] = np.inf
+
+    if n > 4:
+        # centered data keeps the prefix sums small
+        x = np.arange(n) - (n-1)/2
+        y = data_to_fit.astype(np.float64)
+        y = y - np.mean(y)
+
+        s_x = np.concatenate(([0], np.cumsum(x)))
+        s_y = np.concatenate(([0], np.cumsum(y)))
+        s_xx = np.concatenate(([0], np.cumsum(x*x)))
+        s_xy = np.concatenate(([0], np.cumsum(x*y)))
+        s_yy = np.concatenate(([0], np.cumsum(y*y)))
+
+        # first segment is data_to_fit[:i], second one is data_to_fit[i:-1]
+        i = np.arange(2, n-2)
+        distance[i] = np.sqrt(_residual(s_x, s_y, s_xx, s_xy, s_yy, 0, i)) + np.sqrt(_residual(s_x, s_y, s_xx, s_xy, s_yy, i, n-1))
+
+    index = np.argmin(distance)       
+    return data_to_fit[index]
+
+#Distances at or above the soft threshold are left out of the threshold fit, a search radius
+#below it would cut the fitted distances short and move the threshold
+SOFT_THRESHOLD = 10
+
+def _check_search_radius(engine, soft_threshold):
+    search_radius = engine.get_search_radius()
+    if search_radius is not None and search_radius < soft_threshold:
+        raise ValueError("search radius %g is below the soft threshold %g" % (search_radius, soft_threshold))
+
+#Sum of squared residuals of the linear fit of the points in [start, stop)
+def _residual(s_x, s_y, s_xx, s_xy, s_yy, start, stop):
+    m = stop - start
+    x = s_x[stop] - s_x[start]
+    y = s_y[stop] - s_y[start]
+    sxx = s_xx[stop] - s_xx[start] - x*x/m
+    sxy = s_xy[stop] - s_xy[start] - x*y/m
+    syy = s_yy[stop] - s_yy[start] - y*y/m
+    return np.maximum(syy - sxy*sxy/sxx, 0)
 
 class ContactSurfaceArea:
-    def __init__(self, path_O1, name_O1, path_O2, name_O2):
-
-        object1 = Mesh3D(path_O1, name_O1)
-        object2 = Mesh3D(path_O2, name_O2)
-
-        if(object1.get_dim() > object2.get_dim()):
+    #signed: faces of object_p inside object_q are told apart from the faces touching it, they
+    #are left out of the threshold fit and reported as penetration area and depth.
+    #path_O1/path_O2 can also be already loaded Mesh3D objects, and index a callable giving the
+    #spatial index of object_q built by the distance engine, so that both can be reused.
+    #object_p is the mesh with fewer faces, unless query_first makes it object 1, e.g. so that
+    #the index of the same object 2 serves several computations.
+    def __init__(self, path_O1, name_O1, path_O2, name_O2, distance_engine=None, search_radius=None, threshold_samples=None, cache=None, signed=False, index=None, query_first=False):
+        self.__distance_engine = get_distance_engine(distance_engine, search_radius)
+        _check_search_radius(self.__distance_engine, SOFT_THRESHOLD)
+
+        object1 = path_O1 if isinstance(path_O1, Mesh3D) else Mesh3D(path_O1, name_O1)
+        object2 = path_O2 if isinstance(path_O2, Mesh3D) else Mesh3D(path_O2, name_O2)
+
+        if(not query_first and object1.get_dim() > object2.get_dim()):
             self.__object_p = object2
             self.__object_q = object1
         else:
             self.__object_p = object1
             self.__object_q = object2
         
-        self.__soft_threshold = 10
+        self.__soft_threshold = SOFT_THRESHOLD
+        self.__manual_threshold = None
+        self.__threshold_samples = threshold_samples
+        self.__distance = None
+        self.__signed = signed
+        self.__inside = None
+        self.__penetration = None
+        self.__touching_area = 0
+        self.__penetration_area = 0
+        self.__penetration_depth = 0
         self.__number_of_disconnected = 0
         self.__csa_area = 0
-
-    def __compute_distance(self, obj_p, obj_q, queue):
-        obj_q = (obj_q.v0 + obj_q.v1 + obj_q.v2)/3
-        obj_p = (obj_p.v0 + obj_p.v1 + obj_p.v2)/3
-
-        pool = multiprocessing.Pool()
-        
-        distance = pool.map(min_distance, [(obj_p, obj_q, i) for i in range(0,obj_p.shape[0])])
-        return distance
-
-        
+        self.__cache = cache
+        self.__index = index
+        self.__metrics = None
+
+    def __compute_distance(self, obj_p, obj_q, instrumentation):
+        tree = self.__index(obj_q) if self.__index is not None else None
+        if tree is not None:
+            return self.__distance_engine.compute(obj_p, obj_q, tree=tree, progress=instrumentation.progress)
+        return self.__distance_engine.compute(obj_p, obj_q, progress=instrumentation.progress)
     
-    def __find_threshold(self,data_to_fit):
-        x = np.arange(data_to_fit.shape[0])
-        distance = np.empty(data_to_fit.shape[0])
-        distance[:] = np.inf
-
-        for i in range(2,data_to_fit.shape[0]-2):
-            first = data_to_fit[:i]
-            second = data_to_fit[i:-1]
-            p1 = np.poly1d(np.polyfit(x[:i],first,1))
-            p2 = np.poly1d(np.polyfit(x[i:-1],second,1))
-
-            distance[i] = np.linalg.norm(first-p1(x[:i])) + np.linalg.norm(second-p2(x[i:-1]))
-        
-        index = np.argmin(distance)       
-        return data_to_fit[index]
- 
-    def compute(self, queue):           
-        queue.put("Computing distances!")
-        self.__distance = self.__compute_distance(self.__object_p.get_mesh(),self.__object_q.get_mesh(),queue)
-        self.__sorted_distance = np.sort(self.__distance)
-        
-        queue.put("Computing threshold!")
-        self.__threshold = self.__find_threshold(self.__sorted_distance[np.where(self.__sorted_distance<self.__soft_threshold)])
-        
-        queue.put("Computing indexes!")
-        self.__csa_indexes = np.where(self.__distance[:]<self.__threshold)[0]
-        self.__csa_area = self.__object_p.mesh_area(self.__csa_indexes)
-
-        queue.put("Computing disconnected indexes!")
-        self.inspect_mesh(queue)
+    #Cache keys of the distance field and of the full result, from the content of both meshes and the parameters
+    def __cache_keys(self):
+        parts = ["distance", file_hash(self.__object_p.get_path()), file_hash(self.__object_q.get_path()), engine_signature(self.__distance_engine)]
+        if self.__signed:
+            parts.append("signed")
+        distance_key = self.__cache.key(*parts)
+        result_key = self.__cache.key("result", distance_key, self.__soft_threshold, self.__threshold_samples, self.__manual_threshold)
+        return distance_key, result_key
+
+    def __restore_result(self, entry):
+        self.__restore_distance(entry)
+        self.__threshold = entry["threshold"][()]
+        self.__csa_indexes = entry["csa_indexes"]
+        self.__csa_area = float(entry["csa_area"])
+        self.__number_of_disconnected = int(entry["number_of_disconnected"])
+        if self.__signed:
+            self.__signed_areas()
+
+    def __restore_distance(self, entry):
+        self.__distance = entry["distance"]
+        if self.__signed:
+            self.__inside = entry["inside"]
+            self.__penetration = entry["penetration"]
+        self.__sort_distance()
+
+    #Sorted distances for the threshold fit, without the faces inside object_q in signed mode
+    def __sort_distance(self):
+        self.__sorted_distance = np.sort(self.__distance if self.__inside is None else self.__distance[~self.__inside])
+
+    def __signed_arrays(self):
+        return {"inside": self.__inside, "penetration": self.__penetration} if self.__signed else {}
+
+    def __signed_areas(self):
+        self.__touching_area = self.__object_p.mesh_area((self.__distance < self.__threshold) & ~self.__inside)
+        self.__penetration_area = self.__object_p.mesh_area(self.__inside)
+        self.__penetration_depth = float(np.amax(self.__penetration[self.__inside], initial=0))
+
+    #Arrays a cache entry must hold to be restored
+    def __cache_arrays(self, result=False):
+        names = ("distance",) + (("inside", "penetration") if self.__signed else ())
+        if result:
+            names += ("threshold", "csa_indexes", "csa_area", "number_of_disconnected")
+        return names
+
+    #The disconnected parts are not stored, only the connectivity stage uses them and it runs again on recompute
+    def __store_result(self, result_key):
+        self.__cache.put(result_key,
+            distance=self.__distance,
+            threshold=self.__threshold,
+            csa_indexes=self.__csa_indexes,
+            csa_area=self.__csa_area,
+            number_of_disconnected=self.__number_of_disconnected,
+            **self.__signed_arrays())
+
+    #Result in the format of result_file: the contact and inside masks packed as bits, the
+    #float32 distances, the welded meshes, the metrics and the parameters. The object pickles
+    #in this form too, so only the result crosses between processes.
+    def __result_content(self):
+        if self.__metrics is None:
+            raise RuntimeError("compute must be run before the result is saved")
+        header = {
+            "kind": "ContactSurfaceArea",
+            "parameters": {
+                "soft_threshold": self.__soft_threshold,
+                "manual_threshold": self.__manual_threshold,
+                "threshold_samples": self.__threshold_samples,
+                "signed": self.__signed,
+                "distance_engine": engine_name(self.__distance_engine),
+                "search_radius": self.__distance_engine.get_search_radius(),
+            },
+            "meshes": [{"name": mesh.get_name(), "path": None if mesh.get_path() is None else str(mesh.get_path())} for mesh in (self.__object_p, self.__object_q)],
+            "threshold": float(self.__threshold),
+            "number_of_disconnected": int(self.__number_of_disconnected),
+            "metrics": self.__metrics,
+        }
+        arrays = {
+            "contact": np.packbits(self.contact_mask()),
+            "distance": self.__distance.astype(np.float32, copy=False),
+            "vertices_p": self.__object_p.get_vertices(),
+            "faces_p": self.__object_p.get_faces(),
+            "vertices_q": self.__object_q.get_vertices(),
+            "faces_q": self.__object_q.get_faces(),
+        }
+        if self.__signed:
+            arrays["inside"] = np.packbits(self.__inside)
+            arrays["penetration"] = self.__penetration.astype(np.float32, copy=False)
+        return header, arrays
+
+    #A loaded result is displayed and its threshold changed without any computation; its
+    #distances are not computed again. An engine outside DISTANCE_ENGINES is saved as the default one.
+    @classmethod
+    def __from_result(cls, header, arrays):
+        if header.get("kind") != "ContactSurfaceArea":
+            raise ValueError("Not a ContactSurfaceArea result")
+        parameters = header["parameters"]
+        metrics = header["metrics"]
+        object_p, object_q = (Mesh3D.from_arrays(arrays["vertices_"+side], arrays["faces_"+side], mesh["name"], mesh["path"], mesh_metrics) for side, mesh, mesh_metrics in zip("pq", header["meshes"], metrics["meshes"]))
+        result = cls(object_p, None, object_q, None, distance_engine=parameters["distance_engine"], search_radius=parameters["search_radius"], threshold_samples=parameters["threshold_samples"], signed=parameters["signed"], query_first=True)
+        result.__soft_threshold = parameters["soft_threshold"]
+        result.__manual_threshold = parameters["manual_threshold"]
+
+        dim = object_p.get_dim()
+        result.__distance = arrays["distance"]
+        if result.__signed:
+            result.__inside = np.unpackbits(arrays["inside"], count=dim).view(bool)
+            result.__penetration = arrays["penetration"]
+            result.__touching_area = metrics["touching_area"]
+            result.__penetration_area = metrics["penetration_area"]
+            result.__penetration_depth = metrics["penetration_depth"]
+        result.__sort_distance()
+        result.__threshold = header["threshold"]
+        result.__csa_indexes = np.flatnonzero(np.unpackbits(arrays["contact"], count=dim))
+        result.__csa_area = metrics["csa"]
+        result.__number_of_disconnected = header["number_of_disconnected"]
+        result.__metrics = metrics
+        return result
+
+    def to_bytes(self):
+        return pack_result(*self.__result_content())
+
+    #buffer can be any bytes-like object; the arrays of the result stay views of it
+    @classmethod
+    def from_bytes(cls, buffer):
+        return cls.__from_result(*unpack_result(buffer))
+
+    def save(self, path):
+        write_result(path, *self.__result_content())
+
+    #The file is memory mapped unless mmap is False
+    @classmethod
+    def load(cls, path, mmap=True):
+        return cls.__from_result(*read_result(path, mmap))
+
+    #Objects not computed yet pickle their state as usual
+    def __reduce_ex__(self, protocol):
+        if self.__metrics is None:
+            return super().__reduce_ex__(protocol)
+        return (ContactSurfaceArea.from_bytes, (self.to_bytes(),))
+
+    #Pipeline stages, run in this order by compute, and their status messages
+    STAGES = ("distance", "threshold", "indexes", "connectivity", "area", "metrics")
+    STAGE_MESSAGES = {
+        "cache": "Looking for a cached result!",
+        "distance": "Computing distances!",
+        "threshold": "Computing threshold!",
+        "indexes": "Computing indexes!",
+        "connectivity": "Computing disconnected indexes!",
+        "area": "Computing contact area!",
+        "metrics": "Computing mesh metrics!",
+    }
+
+    #The stages report their progress to instrumentation, if given, as faces processed
+    def compute_distance(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        entry = None
+        if self.__cache is not None:
+            distance_key, _ = self.__cache_keys()
+            entry = self.__cache.get(distance_key, self.__cache_arrays())
+
+        if entry is not None:
+            self.__restore_distance(entry)
+        else:
+            self.__distance = self.__compute_distance(self.__object_p,self.__object_q,instrumentation)
+            if self.__signed:
+                self.__inside, depth = inside_surface(self.__object_p.get_centroids(), self.__object_q)
+                self.__penetration = np.where(self.__inside, depth, 0).astype(np.float32)
+            if self.__cache is not None:
+                self.__cache.put(distance_key, distance=self.__distance, **self.__signed_arrays())
+            self.__sort_distance()
+        instrumentation.progress(self.__object_p.get_dim(), self.__object_p.get_dim())
+
+    def compute_threshold(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        if self.__manual_threshold is not None:
+            self.__threshold = self.__manual_threshold
+            return
+        candidates = self.__sorted_distance[np.where(self.__sorted_distance<self.__soft_threshold)]
+        self.__threshold = find_threshold(candidates, self.__threshold_samples)
+        instrumentation.progress(candidates.shape[0], candidates.shape[0])
+
+    def compute_indexes(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        contact = self.__distance[:]<self.__threshold
+        if self.__signed:
+            contact |= self.__inside
+        self.__csa_indexes = np.where(contact)[0]
+        instrumentation.progress(self.__object_p.get_dim(), self.__object_p.get_dim())
+
+    def compute_connectivity(self, instrumentation=None):
+        self.__number_of_disconnected = 0
+        self.inspect_mesh(instrumentation)
         if(self.__number_of_disconnected != 0):
             self.complete_csa()
 
-        queue.put(self)
-        queue.put("end")
-
+    #The CSA is the area of the faces under the threshold, without the parts added by complete_csa.
+    #In signed mode it is the touching area (outside, under the threshold) plus the penetration area.
+    def compute_area(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        if self.__signed:
+            self.__signed_areas()
+            self.__csa_area = self.__touching_area + self.__penetration_area
+        else:
+            self.__csa_area = self.__object_p.mesh_area(self.__distance < self.__threshold)
+        instrumentation.progress(self.__object_p.get_dim(), self.__object_p.get_dim())
+
+    #Metrics returned with the result, so that nothing is left to compute once it is displayed:
+    #the list of the mesh metrics of object_p then object_q (area, volume, bounding box), the CSA,
+    #its fraction of the object_p area and the area of each connected patch, largest first
+    def compute_metrics(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        patches = face_components(self.__object_p.get_faces(), self.contact_mask(), self.__object_p.get_vertices().shape[0])
+        area_p = self.__object_p.metrics()["area"]
+        self.__metrics = {
+            "csa": self.__csa_area,
+            "csa_fraction": self.__csa_area/area_p if area_p > 0 else 0.0,
+            "threshold": float(self.__threshold),
+            "patch_areas": sorted((self.__object_p.mesh_area(faces) for faces in patches), reverse=True),
+            "meshes": [self.__object_p.metrics(), self.__object_q.metrics()],
+        }
+        if self.__signed:
+            self.__metrics.update({"touching_area": self.__touching_area, "penetration_area": self.__penetration_area, "penetration_depth": self.__penetration_depth})
+        instrumentation.progress(self.__object_p.get_dim(), self.__object_p.get_dim())
+
+    def get_metrics(self):
+        return self.__metrics
+
+    #compute_<stage> method of one of the STAGES
+    def stage_function(self, stage):
+        return getattr(self, "compute_" + stage)
+
+    #instrumentation, if given, receives the stage and progress events for its sinks
+    def compute(self, instrumentation=None):
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        instrumentation.set_stages(self.STAGES)
+
+        entry = None
+        if self.__cache is not None:
+            with instrumentation.stage("cache", self.STAGE_MESSAGES["cache"]):
+                _, result_key = self.__cache_keys()
+                entry = self.__cache.get(result_key, self.__cache_arrays(result=True))
+
+        if entry is not None:
+            self.__restore_result(entry)
+        else:
+            for stage in self.STAGES:
+                with instrumentation.stage(stage, self.STAGE_MESSAGES[stage]):
+                    self.stage_function(stage)(instrumentation)
+
+            if self.__cache is not None:
+                self.__store_result(result_key)
+        if entry is not None:
+            with instrumentation.stage("metrics", self.STAGE_MESSAGES["metrics"]):
+                self.compute_metrics(instrumentation)
+
+    #Runs the stages from first_stage on, reusing the distances and the welded mesh of the
+    #previous compute: a new threshold only costs the threshold, connectivity and area stages
+    def recompute(self, first_stage="threshold", instrumentation=None):
+        if self.__distance is None:
+            raise RuntimeError("compute must be run before recompute")
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        for stage in self.STAGES[self.STAGES.index(first_stage):]:
+            with instrumentation.stage(stage, self.STAGE_MESSAGES[stage]):
+                self.stage_function(stage)(instrumentation)
+
+    #Manual contact threshold, None goes back to the threshold fitted on the distances.
+    #The results are updated at once when the distances are already computed.
+    def set_threshold(self, threshold=None):
+        self.__manual_threshold = None if threshold is None else float(threshold)
+        if self.__distance is not None:
+            self.recompute("threshold")
+
+    def get_manual_threshold(self):
+        return self.__manual_threshold
+
+    #Distances above the soft threshold are left out of the threshold fit
+    def set_soft_threshold(self, soft_threshold):
+        _check_search_radius(self.__distance_engine, soft_threshold)
+        self.__soft_threshold = soft_threshold
+        if self.__distance is not None and self.__manual_threshold is None:
+            self.recompute("threshold")
+
+    def get_soft_threshold(self):
+        return self.__soft_threshold
+
+    def get_distance(self):
+        return self.__distance
+
+    #Contact faces of object_p as a boolean mask
+    def contact_mask(self):
+        mask = np.zeros(self.__object_p.get_dim(), dtype=bool)
+        mask[self.__csa_indexes] = True
+        return mask
+
+    #object_p carries the per-face "contact" (0/1) and "distance" cell arrays, not set as active
+    #scalars. The CSA polydata shares its points, only the contact faces are listed.
     def display(self):
-        reader_obj_q = vtk.vtkSTLReader()
-        reader_obj_q.SetFileName(self.__object_q.get_path())    
-        reader_obj_q.Update()
-        obj_q = reader_obj_q.GetOutput()
-
-        reader_obj_p = vtk.vtkSTLReader()
-        reader_obj_p.SetFileName(self.__object_p.get_path())
-        reader_obj_p.Update()
-        obj_p = reader_obj_p.GetOutput()     
-
-        points = np.empty([obj_p.GetPoints().GetData().GetNumberOfTuples(),3])
-        for i in range(0,obj_p.GetPoints().GetData().GetNumberOfTuples()):
-            points[i] = np.asarray(obj_p.GetPoints().GetData().GetTuple(i))
-
-        connectivity = np.empty([int(obj_p.GetPolys().GetNumberOfConnectivityIds()/3),3])
-        temp = obj_p.GetPolys().GetConnectivityArray()
-        for i in range(0,int(obj_p.GetPolys().GetNumberOfConnectivityIds()/3)):
-            connectivity[i] = np.array([int(temp.GetComponent(3*i,0)),int(temp.GetComponent(3*i+1,0)),int(temp.GetComponent(3*i+2,0))])
-        
-        csa_connectvity = connectivity[self.__csa_indexes]
-
-        vtk_points = vtk.vtkPoints()
-        for point in points:
-            vtk_points.InsertNextPoint(point)
+        from rendering import add_cell_array
+        obj_q = self.__object_q.polydata()
+        obj_p = self.__object_p.polydata()
+        for name, values in (("contact", self.contact_mask().view(np.uint8)), ("distance", self.__distance)):
+            add_cell_array(obj_p, name, values)
+        csa = self.csa_polydata(obj_p.GetPoints())
 
-        # Create a vtkCellArray to store the connectivity information
-        vtk_cells = vtk.vtkCellArray()
-        for cell in csa_connectvity:
-            vtk_cells.InsertNextCell(3)  # 3 indicates a triangle cell
-            vtk_cells.InsertCellPoint(np.int64(cell[0]))
-            vtk_cells.InsertCellPoint(np.int64(cell[1]))
-            vtk_cells.InsertCellPoint(np.int64(cell[2]))
-
-        # Create a vtkPolyData object and set the points and cells
-        csa = vtk.vtkPolyData()
-        csa.SetPoints(vtk_points)
-        csa.SetPolys(vtk_cells)
-
-        
         return obj_p, obj_q, csa
 
+    #Polydata of the contact faces alone with their "distance" cell array, e.g. to refresh
+    #the overlay after set_threshold
+    def csa_polydata(self, points=None):
+        from rendering import add_cell_array
+        csa = self.__object_p.polydata(self.__csa_indexes, points)
+        add_cell_array(csa, "distance", self.__distance[self.__csa_indexes], deep=True)
+        return csa
+
     def get_csa(self):
         return self.__csa_area
 
-    def inspect_mesh(self, queue):
-        G = nx.Graph()
+    def get_threshold(self):
+        return float(self.__threshold)
 
-        vertex_to_face = {}
+    def get_number_of_disconnected(self):
+        return self.__number_of_disconnected
 
-        for i in range(0,self.__object_p.get_dim()):
-            if i not in self.__csa_indexes:
-                v0 = tuple(self.__object_p.get_mesh().v0[i])
-                v1 = tuple(self.__object_p.get_mesh().v1[i])
-                v2 = tuple(self.__object_p.get_mesh().v2[i])
-                G.add_edge(v0,v1)
-                G.add_edge(v1,v2)
-                G.add_edge(v2,v0)
+    def is_signed(self):
+        return self.__signed
 
-                vertex_to_face[v0] = vertex_to_face.get(v0, []) + [i]
-                vertex_to_face[v1] = vertex_to_face.get(v1, []) + [i]
-                vertex_to_face[v2] = vertex_to_face.get(v2, []) + [i]
-        
-        is_connected = nx.is_connected(G)
-
-        if not is_connected:
-            # Find the connected components (sub-meshes) of the graph
-            sub_meshes = list(nx.connected_components(G))
-            sub_mesh_face_ids = []
-            for sub_mesh in sub_meshes:
-                face_ids = set()
-                for vertex in sub_mesh:
-                    face_ids.update(vertex_to_face[vertex])
-                sub_mesh_face_ids.append(face_ids)
-                
+    #Faces of object_p inside object_q, None unless signed
+    def get_inside(self):
+        return self.__inside
+
+    def get_touching_area(self):
+        return self.__touching_area
+
+    def get_penetration_area(self):
+        return self.__penetration_area
+
+    #Largest distance from a face of object_p inside object_q to the surface of object_q
+    def get_penetration_depth(self):
+        return self.__penetration_depth
+
+    def inspect_mesh(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        dim = self.__object_p.get_dim()
+        face_mask = np.ones(dim, dtype=bool)
+        face_mask[self.__csa_indexes] = False
+
+        progress = lambda done, total: instrumentation.progress(done*dim//total, dim)
+        sub_mesh_face_ids = face_components(self.__object_p.get_faces(), face_mask, self.__object_p.get_vertices().shape[0], progress)
+
+        if len(sub_mesh_face_ids) > 1:
             self.__indexes_disconnected = sub_mesh_face_ids
-            self.__number_of_disconnected = int(len(sub_meshes))
+            self.__number_of_disconnected = int(len(sub_mesh_face_ids))
             self.__disconnected_areas = np.empty(self.__number_of_disconnected)
+            for i,face_ids in enumerate(sub_mesh_face_ids):
+                self.__disconnected_areas[i] = self.__object_p.mesh_area(face_ids)
 
 
     def complete_csa(self):
         dist = np.zeros(self.__number_of_disconnected)
         for i,l in enumerate(self.__indexes_disconnected):
-            for j,k in enumerate(l):
-                if(dist[i]<self.__distance[k]):
-                    dist[i] = self.__distance[k]
+            dist[i] = np.amax(np.asarray(self.__distance)[l], initial=0)
         
         id_max = np.argmax(dist)
 
         for i,l in enumerate(self.__indexes_disconnected):
             if(i != id_max):
-                for j,k in enumerate(l):
-                    self.__csa_indexes = np.append(self.__csa_indexes,k)
+                self.__csa_indexes = np.append(self.__csa_indexes,l)
 
     def get_area_obj_p(self):    
-        return(self.__object_p.mesh_area(np.arange(self.__object_p.get_dim())))
+        return(self.__object_p.metrics()["area"])
     
     def get_area_obj_q(self):
-        return(self.__object_q.mesh_area(np.arange(self.__object_q.get_dim())))
+        return(self.__object_q.metrics()["area"])
 
     def get_volume_obj_p(self):
         return(self.__object_p.mesh_volume())
@@ -263,4 +587,165 @@ class ContactSurfaceArea:
     
     def get_name_obj_q(self):
         return(self.__object_q.get_name())
-    
\ No newline at end of file
+    
+
+#Contact of one tumor with several organs. The tumor is always the query object: it is
+#loaded and welded once, each organ is loaded and indexed once by the distance engine, and
+#each tumor face is attributed to its nearest organ. The pipeline of ContactSurfaceArea
+#then runs per organ on the faces attributed to it.
+class MultiContactSurfaceArea:
+    #organs is a list of (path, name)
+    def __init__(self, path_tumor, name_tumor, organs, distance_engine=None, search_radius=None, threshold_samples=None):
+        self.__distance_engine = get_distance_engine(distance_engine, search_radius)
+        _check_search_radius(self.__distance_engine, SOFT_THRESHOLD)
+        self.__tumor = Mesh3D(path_tumor, name_tumor)
+        self.__organs = [Mesh3D(path, name) for path, name in organs]
+        self.__soft_threshold = SOFT_THRESHOLD
+        self.__threshold_samples = threshold_samples
+        self.__metrics = None
+
+    STAGES = ("distance", "threshold", "indexes", "connectivity", "area", "metrics")
+    STAGE_MESSAGES = ContactSurfaceArea.STAGE_MESSAGES
+
+    #Distances from every tumor face to every organ, the nearest organ of each face
+    #(-1 when none is within the search radius) and the distance to it
+    def compute_distance(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        dim = self.__tumor.get_dim()
+        n = len(self.__organs)
+        self.__distances = np.empty((n, dim), dtype=np.float32)
+        for i, organ in enumerate(self.__organs):
+            progress = lambda done, total, i=i: instrumentation.progress(i*dim + done*dim//max(total, 1), n*dim)
+            self.__distances[i] = self.__distance_engine.compute(self.__tumor, organ, progress=progress)
+
+        self.__nearest = np.argmin(self.__distances, axis=0).astype(np.int32)
+        self.__distance = self.__distances[self.__nearest, np.arange(dim)]
+        self.__nearest[~np.isfinite(self.__distance)] = -1
+
+    def compute_threshold(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.__thresholds = np.zeros(len(self.__organs))
+        for i in range(len(self.__organs)):
+            attributed = np.sort(self.__distances[i][self.__nearest == i])
+            candidates = attributed[attributed < self.__soft_threshold]
+            if candidates.shape[0] > 0:
+                self.__thresholds[i] = find_threshold(candidates, self.__threshold_samples)
+            instrumentation.progress(i+1, len(self.__organs))
+
+    #Organ of the contact patch of each tumor face, -1 out of contact
+    def compute_indexes(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.__patches = np.full(self.__tumor.get_dim(), -1, dtype=np.int32)
+        for i in range(len(self.__organs)):
+            self.__patches[(self.__nearest == i) & (self.__distances[i] < self.__thresholds[i])] = i
+        self.__labels = self.__patches.copy()
+        instrumentation.progress(self.__tumor.get_dim(), self.__tumor.get_dim())
+
+    #Same completion as ContactSurfaceArea.complete_csa, per organ: the parts cut off from the
+    #rest of the tumor by a patch are added to it, as long as they are attributed to that organ
+    def compute_connectivity(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        n = len(self.__organs)
+        self.__number_of_disconnected = [0]*n
+        for i in range(n):
+            components = face_components(self.__tumor.get_faces(), self.__patches != i, self.__tumor.get_vertices().shape[0])
+            if len(components) > 1:
+                self.__number_of_disconnected[i] = len(components)
+                id_max = np.argmax([np.amax(self.__distances[i][c], initial=0) for c in components])
+                for j, c in enumerate(components):
+                    if j != id_max:
+                        self.__labels[c[self.__nearest[c] == i]] = i
+            instrumentation.progress(i+1, n)
+
+    #The CSA of each organ is the area of its patch, without the parts added by the completion
+    def compute_area(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.__csa_areas = [self.__tumor.mesh_area(self.__patches == i) for i in range(len(self.__organs))]
+        instrumentation.progress(self.__tumor.get_dim(), self.__tumor.get_dim())
+
+    #Metrics returned with the result, as in ContactSurfaceArea.compute_metrics: the list of the
+    #mesh metrics of the tumor then of each organ, and the CSA of each organ with its fraction
+    #of the tumor area
+    def compute_metrics(self, instrumentation=None):
+        instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        meshes = [self.__tumor.metrics()]
+        for i, organ in enumerate(self.__organs):
+            meshes.append(organ.metrics())
+            instrumentation.progress(i+1, len(self.__organs))
+        area = meshes[0]["area"]
+        self.__metrics = {
+            "csa": list(self.__csa_areas),
+            "csa_fraction": [csa/area if area > 0 else 0.0 for csa in self.__csa_areas],
+            "thresholds": [float(t) for t in self.__thresholds],
+            "meshes": meshes,
+        }
+
+    def get_metrics(self):
+        return self.__metrics
+
+    def stage_function(self, stage):
+        return getattr(self, "compute_" + stage)
+
+    #instrumentation as in ContactSurfaceArea.compute
+    def compute(self, instrumentation=None):
+        if instrumentation is None:
+            instrumentation = Instrumentation()
+        instrumentation.set_stages(self.STAGES)
+
+        for stage in self.STAGES:
+            with instrumentation.stage(stage, self.STAGE_MESSAGES[stage]):
+                self.stage_function(stage)(instrumentation)
+
+    #The tumor carries the "organ" (patch label) and "distance" cell arrays; one CSA polydata
+    #per organ shares the tumor points
+    def display(self):
+        from rendering import add_cell_array
+        tumor = self.__tumor.polydata()
+        for name, values in (("organ", self.__labels), ("distance", self.__distance)):
+            add_cell_array(tumor, name, values)
+        organs = [organ.polydata() for organ in self.__organs]
+        csa = [self.__tumor.polydata(np.nonzero(self.__labels == i)[0], tumor.GetPoints()) for i in range(len(self.__organs))]
+        return tumor, organs, csa
+
+    def get_organ_names(self):
+        return [organ.get_name() for organ in self.__organs]
+
+    def get_csa(self):
+        return list(self.__csa_areas)
+
+    def get_thresholds(self):
+        return [float(t) for t in self.__thresholds]
+
+    def get_number_of_disconnected(self):
+        return list(self.__number_of_disconnected)
+
+    #Organ index of the completed CSA of each tumor face, -1 out of contact
+    def get_labels(self):
+        return self.__labels
+
+    def get_nearest_organ(self):
+        return self.__nearest
+
+    def get_distance(self):
+        return self.__distance
+
+    def get_name_tumor(self):
+        return self.__tumor.get_name()
+
+    def get_area_tumor(self):
+        return self.__metrics["meshes"][0]["area"]
+
+    def get_volume_tumor(self):
+        return self.__metrics["meshes"][0]["volume"]
+
+#Job for a ComputeExecutor worker: the whole computation of one pair, returning the computed
+#object, which is sent back in the compact form of ContactSurfaceArea.to_bytes
+def run_contact_surface_area(path_O1, name_O1, path_O2, name_O2, instrumentation=None, **options):
+    csa = ContactSurfaceArea(path_O1, name_O1, path_O2, name_O2, **options)
+    csa.compute(instrumentation=instrumentation)
+    return csa
+
+def run_multi_contact_surface_area(path_tumor, name_tumor, organs, instrumentation=None, **options):
+    csa = MultiContactSurfaceArea(path_tumor, name_tumor, organs, **options)
+    csa.compute(instrumentation=instrumentation)
+    return csa
@@ -0,0 +1,432 @@
+import numpy as np
+
+from executor import SharedArray, get_pool, close_pool
+
+def face_centroids(mesh):
+    if hasattr(mesh, 'get_centroids'):
+        return mesh.get_centroids()
+    return (mesh.v0 + mesh.v1 + mesh.v2)/3
+
+def _limit_distance(distance, search_radius):
+    if search_radius is not None:
+        distance[distance > search_radius] = np.inf
+    return distance
+
+#Closest point on each triangle (a,b,c) to each point p - Voronoi regions test (Ericson, Real-Time Collision Detection 5.1.5)
+def point_triangle_distance(p, a, b, c):
+    p = np.asarray(p, dtype=np.float64)
+    closest, _ = closest_triangle_point(p, a, b, c)
+    return np.linalg.norm(p-closest,axis=1)
+
+#Closest points and the feature of the triangle they lie on: 0 inside the face, 1 + e on
+#the edge from corner e to corner (e+1)%3, 4 + i on the corner i. Degenerate triangles
+#fall back to the closest corner.
+def closest_triangle_point(p, a, b, c):
+    p = np.asarray(p, dtype=np.float64)
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    c = np.asarray(c, dtype=np.float64)
+
+    ab = b-a
+    ac = c-a
+    ap = p-a
+    bp = p-b
+    cp = p-c
+
+    d1 = np.einsum('ij,ij->i',ab,ap)
+    d2 = np.einsum('ij,ij->i',ac,ap)
+    d3 = np.einsum('ij,ij->i',ab,bp)
+    d4 = np.einsum('ij,ij->i',ac,bp)
+    d5 = np.einsum('ij,ij->i',ab,cp)
+    d6 = np.einsum('ij,ij->i',ac,cp)
+
+    va = d3*d6 - d5*d4
+    vb = d5*d2 - d1*d6
+    vc = d1*d4 - d3*d2
+
+    feature = np.zeros(p.shape[0], dtype=np.int8)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # p projects inside the face
+        denom = va + vb + vc
+        closest = a + ab*(vb/denom)[:,None] + ac*(vc/denom)[:,None]
+
+        # the regions are applied from the lowest to the highest priority
+        region = (va <= 0) & ((d4-d3) >= 0) & ((d5-d6) >= 0)
+        w = (d4-d3)/((d4-d3)+(d5-d6))
+        closest[region] = (b + (c-b)*w[:,None])[region]
+        feature[region] = 2
+
+        region = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        w = d2/(d2-d6)
+        closest[region] = (a + ac*w[:,None])[region]
+        feature[region] = 3
+
+        region = (d6 >= 0) & (d5 <= d6)
+        closest[region] = c[region]
+        feature[region] = 6
+
+        region = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        v = d1/(d1-d3)
+        closest[region] = (a + ab*v[:,None])[region]
+        feature[region] = 1
+
+        region = (d3 >= 0) & (d4 <= d3)
+        closest[region] = b[region]
+        feature[region] = 5
+
+        region = (d1 <= 0) & (d2 <= 0)
+        closest[region] = a[region]
+        feature[region] = 4
+
+    degenerate = ~np.all(np.isfinite(closest), axis=1)
+    if degenerate.any():
+        corners = np.stack((a[degenerate], b[degenerate], c[degenerate]), axis=1)
+        corner = np.argmin(np.linalg.norm(corners - p[degenerate][:,None], axis=2), axis=1)
+        closest[degenerate] = corners[np.arange(corners.shape[0]), corner]
+        feature[degenerate] = 4 + corner
+    return closest, feature
+
+def min_distance(args):
+    obj_p, obj_q, i = args
+    return np.amin(np.linalg.norm(obj_q-obj_p[i,:],axis=1))
+
+#min_distance over the obj_p rows start:stop, the centroids being read from shared memory
+def min_distance_block(args):
+    shared_p, shared_q, start, stop = args
+    obj_p = shared_p.array()
+    obj_q = shared_q.array()
+    block = np.array([min_distance((obj_p, obj_q, i)) for i in range(start, stop)])
+    del obj_p, obj_q
+    shared_p.release(unlink=False)
+    shared_q.release(unlink=False)
+    return start, block
+
+# Engines take two meshes exposing v0/v1/v2 and return one float32 distance per obj_p face.
+# Distances above search_radius are reported as np.inf. progress, if given, is called with
+# the number of obj_p faces done and the total.
+
+# Original engine: every obj_q centroid checked for each obj_p centroid. The centroids are
+# shared with the warm worker pool once per call, tasks only carry a block of obj_p rows.
+class BruteForceDistance:
+    def __init__(self, processes=None, search_radius=None, block_size=64):
+        self.__processes = processes
+        self.__search_radius = search_radius
+        self.__block_size = block_size
+
+    def get_search_radius(self):
+        return self.__search_radius
+
+    def compute(self, mesh_p, mesh_q, progress=None):
+        obj_p = face_centroids(mesh_p)
+        obj_q = face_centroids(mesh_q)
+
+        distance = np.empty(obj_p.shape[0], dtype=np.float32)
+        shared_p = SharedArray.create(obj_p)
+        shared_q = SharedArray.create(obj_q)
+        try:
+            tasks = [(shared_p, shared_q, start, min(start + self.__block_size, obj_p.shape[0])) for start in range(0, obj_p.shape[0], self.__block_size)]
+            done = 0
+            for start, block in get_pool(self.__processes).imap_unordered(min_distance_block, tasks):
+                distance[start:start+block.shape[0]] = block
+                done += block.shape[0]
+                if progress is not None:
+                    progress(done, obj_p.shape[0])
+        except BaseException:
+            # stop the blocks still queued, they read memory about to be released
+            close_pool(terminate=True)
+            raise
+        finally:
+            shared_p.release()
+            shared_q.release()
+        return _limit_distance(distance, self.__search_radius)
+
+# KD-tree over the obj_q centroids, queried in batches of nearest neighbours
+class KDTreeDistance:
+    def __init__(self, batch_size=65536, workers=-1, search_radius=None):
+        self.__batch_size = batch_size
+        self.__workers = workers
+        self.__search_radius = search_radius
+
+    def get_search_radius(self):
+        return self.__search_radius
+
+    def build(self, mesh_q):
+        from scipy.spatial import cKDTree
+        return cKDTree(face_centroids(mesh_q))
+
+    def compute(self, mesh_p, mesh_q, tree=None, progress=None):
+        if tree is None:
+            tree = self.build(mesh_q)
+        obj_p = face_centroids(mesh_p)
+
+        bound = np.inf if self.__search_radius is None else self.__search_radius
+        distance = np.empty(obj_p.shape[0], dtype=np.float32)
+        for start in range(0, obj_p.shape[0], self.__batch_size):
+            stop = min(start + self.__batch_size, obj_p.shape[0])
+            distance[start:stop], _ = tree.query(obj_p[start:stop], k=1, distance_upper_bound=bound, workers=self.__workers)
+            if progress is not None:
+                progress(stop, obj_p.shape[0])
+        return distance
+
+#Order of the points along a Morton (Z-order) curve, so that consecutive points are close
+def _morton_order(points, bits=10):
+    low = np.amin(points, axis=0)
+    extent = max(float(np.amax(np.amax(points, axis=0) - low)), np.finfo(np.float32).tiny)
+    cells = ((points - low)/extent*((1 << bits) - 1)).astype(np.uint64)
+    code = np.zeros(points.shape[0], dtype=np.uint64)
+    for bit in range(bits):
+        for axis in range(3):
+            code |= ((cells[:,axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(3*bit + axis)
+    return np.argsort(code, kind='stable')
+
+#Bounding boxes of consecutive blocks of block_size points
+def _block_boxes(points, block_size):
+    starts = np.arange(0, points.shape[0], block_size)
+    return np.minimum.reduceat(points, starts, axis=0), np.maximum.reduceat(points, starts, axis=0)
+
+# Same centroid distances as KDTreeDistance, computed tile by tile with bounded memory. Both
+# centroid sets are put in Morton order and cut in blocks with a bounding box; each tile of
+# obj_p centroids is compared with the obj_q blocks from the nearest box outwards, stopping
+# at the first box farther than every distance found so far (or than search_radius).
+# Temporaries are tile_size x block_size, results go to a preallocated float32 buffer.
+class TiledDistance:
+    def __init__(self, tile_size=128, block_size=512, search_radius=None):
+        self.__tile_size = tile_size
+        self.__block_size = block_size
+        self.__search_radius = search_radius
+
+    def get_search_radius(self):
+        return self.__search_radius
+
+    def build(self, mesh_q):
+        centroids = face_centroids(mesh_q)
+        blocks = np.asarray(centroids[_morton_order(centroids)], dtype=np.float64)
+        low, high = _block_boxes(blocks, self.__block_size)
+        return blocks, low, high
+
+    #out, if given, is the float32 buffer receiving the distances
+    def compute(self, mesh_p, mesh_q, tree=None, progress=None, out=None):
+        if tree is None:
+            tree = self.build(mesh_q)
+        blocks, low, high = tree
+        block_norm = np.sum(blocks*blocks, axis=1)
+        obj_p = face_centroids(mesh_p)
+        order = _morton_order(obj_p)
+
+        distance = out if out is not None else np.empty(obj_p.shape[0], dtype=np.float32)
+        bound = np.inf if self.__search_radius is None else self.__search_radius
+        for start in range(0, obj_p.shape[0], self.__tile_size):
+            rows = order[start:start + self.__tile_size]
+            tile = np.asarray(obj_p[rows], dtype=np.float64)
+
+            # gap between the tile box and every block box
+            gap = np.maximum(np.maximum(low - np.amax(tile, axis=0), np.amin(tile, axis=0) - high), 0)
+            box_distance = np.sqrt(np.sum(gap*gap, axis=1))
+
+            # squared distances from |p|^2 + |q|^2 - 2 p.q, the nearest centroid found
+            # is then measured again directly to avoid the cancellation near contact
+            tile_norm = np.sum(tile*tile, axis=1)
+            best = np.full(tile.shape[0], np.inf)
+            nearest = np.zeros(tile.shape[0], dtype=np.intp)
+            for b in np.argsort(box_distance, kind='stable'):
+                if box_distance[b] > bound:
+                    break
+                # only the points whose best distance is beyond the box can improve
+                active = np.nonzero(best > box_distance[b]**2)[0]
+                if active.shape[0] == 0:
+                    break
+                first = b*self.__block_size
+                block = blocks[first:first + self.__block_size]
+                squared = tile_norm[active,None] + block_norm[first:first + self.__block_size][None,:] - 2*(tile[active] @ block.T)
+                column = np.argmin(squared, axis=1)
+                value = squared[np.arange(active.shape[0]), column]
+                closer = value < best[active]
+                best[active[closer]] = value[closer]
+                nearest[active[closer]] = first + column[closer]
+
+            distance[rows] = np.sqrt(np.sum((tile - blocks[nearest])**2, axis=1))
+            if progress is not None:
+                progress(min(start + self.__tile_size, obj_p.shape[0]), obj_p.shape[0])
+        return _limit_distance(distance, self.__search_radius)
+
+# Exact distance from each obj_p centroid to the closest point of the obj_q surface.
+# The KD-trees over the obj_q centroids give candidate faces: a face whose centroid is
+# farther than d + r from the point cannot be closer than d, r being the largest
+# centroid-to-vertex distance of the faces in that tree. Faces are split in size levels
+# (r doubling at each level) so that a few large faces do not widen every search.
+class SurfaceDistance:
+    def __init__(self, batch_size=16384, k=8, workers=-1, search_radius=None):
+        self.__batch_size = batch_size
+        self.__k = k
+        self.__workers = workers
+        self.__search_radius = search_radius
+
+    def get_search_radius(self):
+        return self.__search_radius
+
+    def build(self, mesh_q):
+        from scipy.spatial import cKDTree
+        centroids = face_centroids(mesh_q)
+        corners = (mesh_q.v0, mesh_q.v1, mesh_q.v2)
+        radius = np.sqrt(np.amax([np.sum((v-centroids)**2,axis=1) for v in corners],axis=0))
+
+        reference = max(float(np.median(radius)), np.finfo(np.float32).tiny)
+        level = np.floor(np.log2(np.maximum(radius/reference, 1))).astype(int)
+
+        levels = []
+        for l in np.unique(level):
+            faces = np.nonzero(level == l)[0]
+            levels.append((cKDTree(centroids[faces]), faces, float(np.amax(radius[faces]))))
+        return levels, corners
+
+    def compute(self, mesh_p, mesh_q, tree=None, progress=None):
+        if tree is None:
+            tree = self.build(mesh_q)
+        obj_p = face_centroids(mesh_p)
+
+        distance = np.empty(obj_p.shape[0], dtype=np.float32)
+        for start in range(0, obj_p.shape[0], self.__batch_size):
+            stop = min(start + self.__batch_size, obj_p.shape[0])
+            distance[start:stop] = self.__query(obj_p[start:stop], tree)
+            if progress is not None:
+                progress(stop, obj_p.shape[0])
+        return distance
+
+    #Exact distance and closest face of obj_q for each point, with no search radius
+    def closest_faces(self, points, tree):
+        distance = np.empty(points.shape[0])
+        face = np.full(points.shape[0], -1, dtype=np.intp)
+        for start in range(0, points.shape[0], self.__batch_size):
+            stop = min(start + self.__batch_size, points.shape[0])
+            distance[start:stop] = self.__query(points[start:stop], tree, face[start:stop])
+        return distance, face
+
+    #closest, if given, receives the face where the distance of each row is reached
+    def __exact(self, distance, points, rows, face, corners, closest=None):
+        if rows.shape[0] > 0:
+            v0, v1, v2 = corners
+            exact = point_triangle_distance(points[rows], v0[face], v1[face], v2[face])
+            if closest is None:
+                np.minimum.at(distance, rows, exact)
+                return
+            # closest candidate of every row, kept where it improves on the faces seen before
+            order = np.lexsort((exact, rows))
+            first = order[np.concatenate(([True], rows[order][1:] != rows[order][:-1]))]
+            better = first[exact[first] < distance[rows[first]]]
+            distance[rows[better]] = exact[better]
+            closest[rows[better]] = face[better]
+
+    def __query(self, points, tree, closest=None):
+        levels, corners = tree
+        distance = np.full(points.shape[0], np.inf)
+
+        # k nearest centroids of every level give an upper bound of the distance,
+        # faces with no centroid within search_radius + r are out of contact
+        nearest = []
+        for kdtree, faces, radius in levels:
+            k = min(self.__k, kdtree.n)
+            bound = np.inf if self.__search_radius is None else self.__search_radius + radius
+            centroid_distance, ids = kdtree.query(points, k=k, distance_upper_bound=bound, workers=self.__workers)
+            centroid_distance = centroid_distance.reshape(points.shape[0], k)
+            ids = ids.reshape(points.shape[0], k)
+
+            found = np.isfinite(centroid_distance)
+            rows, cols = np.nonzero(found)
+            self.__exact(distance, points, rows, faces[ids[rows,cols]], corners, closest)
+            nearest.append(np.where(found[:,-1], centroid_distance[:,-1], np.inf))
+
+        # points where a face beyond the k nearest centroids could still be closer
+        upper = distance if self.__search_radius is None else np.minimum(distance, self.__search_radius)
+        for (kdtree, faces, radius), kth in zip(levels, nearest):
+            pending = np.nonzero(kth - radius < upper)[0]
+            if pending.shape[0] == 0:
+                continue
+            candidates = kdtree.query_ball_point(points[pending], upper[pending] + radius, workers=self.__workers)
+            counts = np.array([len(c) for c in candidates])
+            rows = np.repeat(pending, counts)
+            ids = np.concatenate([np.asarray(c, dtype=np.intp) for c in candidates])
+            self.__exact(distance, points, rows, faces[ids], corners, closest)
+
+        return _limit_distance(distance, self.__search_radius)
+
+#Sums of the rows of values (n,3) with the same index, size rows
+def _scatter_sum(index, values, size):
+    return np.stack([np.bincount(index, weights=values[:,i], minlength=size) for i in range(3)], axis=1)
+
+#Pseudo-normals of a closed Mesh3D (Baerentzen and Aanaes, Signed distance computation
+#using the angle weighted pseudonormal): the face normals, outwards, the edge normals as
+#the sum of the normals of the faces sharing the edge with the edge of each face corner
+#(edge e from corner e to corner (e+1)%3), and the vertex normals weighted by the angle
+#of each face at the vertex
+def pseudo_normals(mesh):
+    faces = mesh.get_faces()
+    vertices = mesh.get_vertices()
+    normals = mesh.get_normals().astype(np.float64)
+    # divergence theorem: the volume is the sum of centroid.normal*area/3, negative when the faces are wound inwards
+    if np.einsum('ij,ij,i->', mesh.get_centroids(), normals, mesh.face_areas()) < 0:
+        normals = -normals
+
+    following = np.roll(faces, -1, axis=1)
+    keys = np.minimum(faces, following).astype(np.int64)*vertices.shape[0] + np.maximum(faces, following)
+    _, edge_ids = np.unique(keys.ravel(), return_inverse=True)
+    edge_ids = edge_ids.reshape(faces.shape)
+    edge_normals = _scatter_sum(edge_ids.ravel(), np.repeat(normals, 3, axis=0), int(edge_ids.max(initial=-1)) + 1)
+
+    corners = vertices[faces].astype(np.float64)
+    vertex_normals = np.zeros((vertices.shape[0], 3))
+    for i in range(3):
+        u = corners[:,(i+1)%3] - corners[:,i]
+        w = corners[:,(i+2)%3] - corners[:,i]
+        angle = np.arctan2(np.linalg.norm(np.cross(u, w), axis=1), np.einsum('ij,ij->i', u, w))
+        vertex_normals += _scatter_sum(faces[:,i], normals*angle[:,None], vertices.shape[0])
+    return normals, edge_ids, edge_normals, vertex_normals
+
+#Side of the closed surface mesh_q (a Mesh3D) on which each point lies. The closest face is
+#found by the exact search of SurfaceDistance; the point is inside when it is behind the
+#pseudo-normal of the face, edge or vertex holding the closest point, which gives the right
+#side even where several faces are equally close. Returns the inside mask and the distance
+#to the surface.
+def inside_surface(points, mesh_q, k=8, batch_size=16384, workers=-1):
+    points = np.asarray(points, dtype=np.float64)
+    engine = SurfaceDistance(batch_size=batch_size, k=k, workers=workers)
+    distance, face = engine.closest_faces(points, engine.build(mesh_q))
+
+    faces = mesh_q.get_faces()
+    vertices = mesh_q.get_vertices()
+    closest, feature = closest_triangle_point(points, vertices[faces[face,0]], vertices[faces[face,1]], vertices[faces[face,2]])
+
+    face_normals, edge_ids, edge_normals, vertex_normals = pseudo_normals(mesh_q)
+    normal = face_normals[face]
+    edge = (feature >= 1) & (feature <= 3)
+    normal[edge] = edge_normals[edge_ids[face[edge], feature[edge]-1]]
+    vertex = feature >= 4
+    normal[vertex] = vertex_normals[faces[face[vertex], feature[vertex]-4]]
+
+    inside = np.einsum('ij,ij->i', points - closest, normal) < 0
+    return inside, distance.astype(np.float32)
+
+DISTANCE_ENGINES = {
+    "kdtree": KDTreeDistance,
+    "bruteforce": BruteForceDistance,
+    "surface": SurfaceDistance,
+    "tiled": TiledDistance,
+}
+
+DEFAULT_DISTANCE_ENGINE = "kdtree"
+
+#Text identifying the engine and the parameters that change its output
+def engine_signature(engine):
+    return "%s(search_radius=%r)" % (type(engine).__name__, engine.get_search_radius())
+
+#Name of the engine in DISTANCE_ENGINES, None for other engines
+def engine_name(engine):
+    return next((name for name, engine_class in DISTANCE_ENGINES.items() if type(engine) is engine_class), None)
+
+def get_distance_engine(engine=None, search_radius=None):
+    if engine is None:
+        engine = DEFAULT_DISTANCE_ENGINE
+    if isinstance(engine, str):
+        if engine not in DISTANCE_ENGINES:
+            raise ValueError("Unknown distance engine: " + engine)
+        return DISTANCE_ENGINES[engine](search_radius=search_radius)
+    return engine
@@ -0,0 +1,347 @@
+import atexit, itertools, multiprocessing, queue, threading, time, traceback
+from multiprocessing import shared_memory
+import numpy as np
+
+from instrumentation import Instrumentation, ComputationCancelled
+
+class ComputationTimeout(ComputationCancelled):
+    pass
+
+class ComputationError(Exception):
+    pass
+
+#NumPy array in a multiprocessing.shared_memory block. The object pickles as the block name,
+#shape and dtype only: other processes attach to the same memory instead of receiving a copy.
+class SharedArray:
+    def __init__(self, name, shape, dtype):
+        self.__name = name
+        self.__shape = tuple(shape)
+        self.__dtype = np.dtype(dtype).str
+        self.__memory = None
+
+    @classmethod
+    def create(cls, array):
+        array = np.ascontiguousarray(array)
+        memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = cls(memory.name, array.shape, array.dtype)
+        shared.__memory = memory
+        shared.array()[...] = array
+        return shared
+
+    def __getstate__(self):
+        return (self.__name, self.__shape, self.__dtype)
+
+    def __setstate__(self, state):
+        self.__name, self.__shape, self.__dtype = state
+        self.__memory = None
+
+    def array(self):
+        if self.__memory is None:
+            self.__memory = _attach(self.__name)
+        return np.ndarray(self.__shape, dtype=self.__dtype, buffer=self.__memory.buf)
+
+    #Only the creating process unlinks the block, after every user is done with it.
+    #Arrays returned by array() must be dropped first.
+    def release(self, unlink=True):
+        if self.__memory is not None:
+            _attached.pop(self.__name, None)
+            self.__memory.close()
+            if unlink:
+                self.__memory.unlink()
+            self.__memory = None
+
+_attached = {}
+
+#Attached blocks are kept open until released. Workers share the resource tracker of the
+#process that created the block, so attaching does not change who unlinks it.
+def _attach(name):
+    if name not in _attached:
+        try:
+            memory = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            memory = shared_memory.SharedMemory(name=name)
+        _attached[name] = memory
+    return _attached[name]
+
+_pool = None
+_pool_processes = None
+
+#Process-wide pool of warm workers, created on first use and reused by later calls
+def get_pool(processes=None):
+    global _pool, _pool_processes
+    if _pool is None or _pool_processes != processes:
+        close_pool()
+        _pool = multiprocessing.Pool(processes)
+        _pool_processes = processes
+    return _pool
+
+def close_pool(terminate=False):
+    global _pool
+    if _pool is not None:
+        if terminate:
+            _pool.terminate()
+        else:
+            _pool.close()
+        _pool.join()
+        _pool = None
+
+atexit.register(close_pool)
+
+#Worker process of ComputeExecutor: runs the jobs sent on its own task queue and reports
+#events, results and errors on the shared result queue
+def _worker(index, tasks, results, cancel):
+    global _pool
+    # a forked worker inherits the parent's pool, which it cannot use
+    _pool = None
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            task = tasks.get(timeout=1)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                break
+            continue
+        if task is None:
+            break
+
+        job_id, function, args, kwargs, forward_events = task
+        sinks = [lambda event: results.put(("event", job_id, event))] if forward_events else []
+        instrumentation = Instrumentation(sinks=sinks, cancelled=cancel.is_set)
+        try:
+            value = function(*args, instrumentation=instrumentation, **kwargs)
+            results.put(("result", job_id, value))
+        except ComputationCancelled:
+            results.put(("cancelled", job_id, None))
+        except Exception as e:
+            results.put(("error", job_id, "%s: %s\n%s" % (type(e).__name__, e, traceback.format_exc())))
+    close_pool()
+
+#Handle of a job submitted to ComputeExecutor
+class Job:
+    def __init__(self, executor, job_id, timeout):
+        self.__executor = executor
+        self.__id = job_id
+        self.__timeout = timeout
+        self.__events = queue.Queue()
+        self.__done = threading.Event()
+        self.__callbacks = []
+        self.__lock = threading.Lock()
+        self.__value = None
+        self.__error = None
+
+    def get_id(self):
+        return self.__id
+
+    def get_timeout(self):
+        return self.__timeout
+
+    def cancel(self):
+        self.__executor.cancel(self)
+
+    def done(self):
+        return self.__done.is_set()
+
+    #Instrumentation events of the job, until it finishes
+    def events(self):
+        while True:
+            event = self.__events.get()
+            if event is None:
+                break
+            yield event
+
+    def result(self, timeout=None):
+        if not self.__done.wait(timeout):
+            raise TimeoutError("Job %d still running" % self.__id)
+        if self.__error is not None:
+            raise self.__error
+        return self.__value
+
+    def add_done_callback(self, callback):
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(callback)
+                return
+        callback(self)
+
+    def _event(self, event):
+        self.__events.put(event)
+
+    def _finish(self, value=None, error=None):
+        with self.__lock:
+            if self.__done.is_set():
+                return
+            self.__value = value
+            self.__error = error
+            self.__done.set()
+            callbacks = self.__callbacks
+            self.__callbacks = []
+        self.__events.put(None)
+        for callback in callbacks:
+            callback(self)
+
+#Long-lived worker processes for whole computations, shared by the GUI and the batch mode.
+#Workers stay warm between jobs; a job is a picklable function called in a worker with an
+#instrumentation keyword argument. Jobs are cancelled cooperatively through the
+#instrumentation; a worker that does not stop within grace seconds is terminated and replaced.
+class ComputeExecutor:
+    def __init__(self, workers=1, grace=5.0):
+        self.__workers = max(1, workers or multiprocessing.cpu_count())
+        self.__grace = grace
+        self.__results = multiprocessing.Queue()
+        self.__ids = itertools.count(1)
+        self.__lock = threading.Lock()
+        self.__pending = []
+        self.__jobs = {}
+        self.__slots = [None]*self.__workers
+        for index in range(self.__workers):
+            self.__start_worker(index)
+
+        self.__running = True
+        self.__pump = threading.Thread(target=self.__loop, daemon=True)
+        self.__pump.start()
+
+    def __start_worker(self, index):
+        tasks = multiprocessing.Queue()
+        cancel = multiprocessing.Event()
+        process = multiprocessing.Process(target=_worker, args=(index, tasks, self.__results, cancel))
+        process.start()
+        # running job, its deadline, when and why it was asked to stop
+        self.__slots[index] = {"process": process, "tasks": tasks, "cancel": cancel, "job": None, "deadline": None, "cancelled_at": None, "reason": None}
+
+    def get_workers(self):
+        return self.__workers
+
+    def submit(self, function, *args, timeout=None, forward_events=True, **kwargs):
+        job = Job(self, next(self.__ids), timeout)
+        with self.__lock:
+            if not self.__running:
+                raise RuntimeError("Executor is shut down")
+            self.__pending.append((job, function, args, kwargs, forward_events))
+            self.__dispatch()
+        return job
+
+    #Jobs as they finish
+    def as_completed(self, jobs):
+        finished = queue.Queue()
+        for job in jobs:
+            job.add_done_callback(finished.put)
+        for _ in range(len(jobs)):
+            yield finished.get()
+
+    def cancel(self, job):
+        with self.__lock:
+            for i, (pending, *_) in enumerate(self.__pending):
+                if pending is job:
+                    del self.__pending[i]
+                    job._finish(error=ComputationCancelled("Computation cancelled"))
+                    return
+            for slot in self.__slots:
+                if slot["job"] is job and slot["cancelled_at"] is None:
+                    self.__stop(slot, ComputationCancelled("Computation cancelled"))
+
+    def __stop(self, slot, reason):
+        slot["cancel"].set()
+        slot["cancelled_at"] = time.monotonic()
+        slot["reason"] = reason
+
+    def __dispatch(self):
+        for slot in self.__slots:
+            if not self.__pending:
+                break
+            if slot["job"] is None:
+                job, function, args, kwargs, forward_events = self.__pending.pop(0)
+                slot["cancel"].clear()
+                slot["job"] = job
+                slot["deadline"] = time.monotonic() + job.get_timeout() if job.get_timeout() is not None else None
+                slot["cancelled_at"] = None
+                slot["reason"] = None
+                self.__jobs[job.get_id()] = job
+                slot["tasks"].put((job.get_id(), function, args, kwargs, forward_events))
+
+    #Frees the worker of a finished job, returns the job and why it was stopped
+    def __release(self, job_id):
+        reason = None
+        for slot in self.__slots:
+            if slot["job"] is not None and slot["job"].get_id() == job_id:
+                reason = slot["reason"]
+                slot["job"] = None
+                slot["deadline"] = None
+                slot["cancelled_at"] = None
+                slot["reason"] = None
+        return self.__jobs.pop(job_id, None), reason
+
+    def __loop(self):
+        while self.__running:
+            try:
+                kind, job_id, payload = self.__results.get(timeout=0.1)
+            except queue.Empty:
+                kind = None
+            except (EOFError, OSError):
+                break
+
+            with self.__lock:
+                if kind == "event":
+                    job = self.__jobs.get(job_id)
+                    if job is not None:
+                        job._event(payload)
+                elif kind is not None:
+                    job, reason = self.__release(job_id)
+                    if job is not None:
+                        if kind == "result":
+                            job._finish(value=payload)
+                        elif kind == "cancelled":
+                            job._finish(error=reason if reason is not None else ComputationCancelled("Computation cancelled"))
+                        else:
+                            job._finish(error=ComputationError(payload))
+                self.__watch()
+                self.__dispatch()
+
+    #Timeouts, workers that ignore a cancellation and workers that died
+    def __watch(self):
+        now = time.monotonic()
+        for index, slot in enumerate(self.__slots):
+            job = slot["job"]
+            if job is None:
+                continue
+            if slot["deadline"] is not None and now >= slot["deadline"] and slot["cancelled_at"] is None:
+                self.__stop(slot, ComputationTimeout("Computation timed out"))
+
+            dead = not slot["process"].is_alive()
+            stuck = slot["cancelled_at"] is not None and now - slot["cancelled_at"] > self.__grace
+            if dead or stuck:
+                slot["process"].terminate()
+                slot["process"].join()
+                self.__jobs.pop(job.get_id(), None)
+                if stuck:
+                    job._finish(error=slot["reason"])
+                else:
+                    job._finish(error=ComputationError("Worker process exited with code %s" % slot["process"].exitcode))
+                self.__start_worker(index)
+
+    def shutdown(self, wait=True):
+        with self.__lock:
+            if not self.__running:
+                return
+            self.__running = False
+            for job, *_ in self.__pending:
+                job._finish(error=ComputationCancelled("Executor shut down"))
+            self.__pending = []
+            for slot in self.__slots:
+                if slot["job"] is not None:
+                    slot["cancel"].set()
+                slot["tasks"].put(None)
+        self.__pump.join()
+
+        for slot in self.__slots:
+            slot["process"].join(self.__grace if wait else 0)
+            if slot["process"].is_alive():
+                slot["process"].terminate()
+                slot["process"].join()
+            if slot["job"] is not None:
+                slot["job"]._finish(error=ComputationCancelled("Executor shut down"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
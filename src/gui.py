@@ -1,49 +1,69 @@
-import sys, vtk, os, multiprocessing
+import sys, os, multiprocessing
 import vtkmodules.vtkRenderingCore as vtkRenderingCore
+import vtkmodules.vtkRenderingOpenGL2 # render window backend
+from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
 
 from PyQt5.QtGui import QIcon
-from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QVBoxLayout, QWidget, QPushButton, QLabel, QGridLayout, QSizePolicy
+from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QLabel, QGridLayout, QSizePolicy, QProgressBar, QSpinBox, QSlider, QCheckBox
 from PyQt5.QtCore import Qt, QThread, pyqtSignal, QTimer
 
-from csa import *
+from csa import ContactSurfaceArea, MultiContactSurfaceArea, run_contact_surface_area, run_multi_contact_surface_area
+from rendering import LODActor
+from cache import ResultCache
+from instrumentation import describe
+from executor import ComputeExecutor, ComputationCancelled, ComputationTimeout, ComputationError
 from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 
 
 class ComputationThread(QThread):
-    status_updated = pyqtSignal(str)
+    progress_updated = pyqtSignal(object)
     computation_finished = pyqtSignal(object)
+    computation_failed = pyqtSignal(str)
 
-    def __init__(self, tumor_path, organ_path):
+    #With several organ files the contact with each organ is computed in one multi-organ job
+    def __init__(self, tumor_path, organ_paths, executor, timeout=None):
         super().__init__()
         self.tumor_path = tumor_path
-        self.organ_path = organ_path
+        self.organ_paths = organ_paths
+        self.organ_path = organ_paths[0]
+        self.executor = executor
+        self.timeout = timeout
+        self.job = None
 
+    #The computation runs in a warm worker of the executor, this thread only relays its events
     def run(self):
-        csa = ContactSurfaceArea(self.tumor_path, "tumor", self.organ_path, "organ")
-
-        status_queue = multiprocessing.Queue()
-        process = multiprocessing.Process(target=csa.compute, args=(status_queue,))
-
-
-        process.start()       
+        if len(self.organ_paths) == 1:
+            self.job = self.executor.submit(run_contact_surface_area, self.tumor_path, "tumor", self.organ_path, "organ", timeout=self.timeout, cache=ResultCache())
+        else:
+            organs = [(path, os.path.splitext(os.path.basename(path))[0]) for path in self.organ_paths]
+            self.job = self.executor.submit(run_multi_contact_surface_area, self.tumor_path, "tumor", organs, timeout=self.timeout)
+
+        for event in self.job.events():
+            self.progress_updated.emit(event)
+
+        try:
+            csa = self.job.result()
+        except ComputationTimeout:
+            self.computation_failed.emit("Computation timed out")
+        except ComputationCancelled:
+            self.computation_failed.emit("Computation cancelled")
+        except ComputationError as e:
+            self.computation_failed.emit("Computation failed: " + str(e).splitlines()[0])
+        else:
+            self.computation_finished.emit(csa)
 
-        while True:
-            status_message = status_queue.get()
-            if status_message == "end":
-                break
-            if type(status_message) == str:
-                self.status_updated.emit(status_message)
-            else:
-                self.computation_finished.emit(status_message)
+    def cancel(self):
+        if self.job is not None:
+            self.job.cancel()
 
-    def run_computation(self, status_queue):
-        csa = ContactSurfaceArea(self.tumor_path, "tumor", self.organ_path, "organ")
-        csa.compute(status_queue)
-        status_queue.put("end")
+# saved results, see ContactSurfaceArea.save
+RESULT_EXTENSION = ".csa"
+RESULT_FILTER = "CSA Results (*.csa)"
 
 class FileSelectionWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, executor=None):
         super().__init__()
+        self.executor = executor if executor is not None else ComputeExecutor()
         self.setWindowTitle("File Selection")
         self.setGeometry(100, 100, 400, 200)
 
@@ -56,20 +76,46 @@ class FileSelectionWindow(QMainWindow):
         self.tumor_button.clicked.connect(self.select_tumor)
         self.layout.addWidget(self.tumor_button)
 
-        self.organ_button = QPushButton("Select Organ File", self.central_widget)
+        self.organ_button = QPushButton("Select Organ File(s)", self.central_widget)
         self.organ_button.clicked.connect(self.select_organ)
         self.layout.addWidget(self.organ_button)
 
         self.text_box = QLabel(self.central_widget)
         self.layout.addWidget(self.text_box)       
 
+        self.progress_bar = QProgressBar(self.central_widget)
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setVisible(False)
+        self.layout.addWidget(self.progress_bar)
+        self.stage_message = ""
+
         self.computation_button = QPushButton("Start Computation", self.central_widget)
         self.computation_button.clicked.connect(self.start_computation)
         self.computation_button.setEnabled(False)
         self.layout.addWidget(self.computation_button)
 
+        self.timeout_layout = QHBoxLayout()
+        self.timeout_layout.addWidget(QLabel("Timeout", self.central_widget))
+        self.timeout_box = QSpinBox(self.central_widget)
+        self.timeout_box.setRange(0, 24*3600)
+        self.timeout_box.setSuffix(" s")
+        self.timeout_box.setSpecialValueText("None")
+        self.timeout_layout.addWidget(self.timeout_box)
+        self.layout.addLayout(self.timeout_layout)
+
+        self.cancel_button = QPushButton("Cancel", self.central_widget)
+        self.cancel_button.clicked.connect(self.cancel_computation)
+        self.cancel_button.setVisible(False)
+        self.layout.addWidget(self.cancel_button)
+
+        self.open_button = QPushButton("Open Saved Result", self.central_widget)
+        self.open_button.clicked.connect(self.open_result)
+        self.layout.addWidget(self.open_button)
+
         self.tumor_path = None
         self.organ_path = None
+        self.organ_paths = []
 
         self.results_window = None
         self.timer = QTimer(self)
@@ -91,16 +137,33 @@ class FileSelectionWindow(QMainWindow):
             self.tumor_button.setText(f"Tumor File: {file_path}")
             self.check_files_selected()
 
+    #Several organ files can be selected at once for a multi-organ computation
     def select_organ(self):
         file_dialog = QFileDialog()
-        file_path, _ = file_dialog.getOpenFileName(self, "Select Organ File", "", "STL Files (*.stl)")
-        if file_path:
-            self.organ_path = file_path
-            self.organ_button.setText(f"Organ File: {file_path}")
+        file_paths, _ = file_dialog.getOpenFileNames(self, "Select Organ Files", "", "STL Files (*.stl)")
+        if file_paths:
+            self.organ_paths = file_paths
+            self.organ_path = file_paths[0]
+            if len(file_paths) == 1:
+                self.organ_button.setText(f"Organ File: {file_paths[0]}")
+            else:
+                self.organ_button.setText("Organ Files: " + ", ".join(os.path.basename(path) for path in file_paths))
             self.check_files_selected()
 
+    #A result saved from the results window is displayed again without any computation
+    def open_result(self):
+        file_dialog = QFileDialog()
+        file_path, _ = file_dialog.getOpenFileName(self, "Open Saved Result", "", RESULT_FILTER)
+        if file_path:
+            try:
+                result = ContactSurfaceArea.load(file_path)
+            except (OSError, ValueError, KeyError) as e:
+                self.text_box.setText("Cannot open %s: %s" % (os.path.basename(file_path), e))
+                return
+            self.open_results_window(result)
+
     def check_files_selected(self):
-        if self.tumor_path and self.organ_path and self.tumor_path.endswith(".stl") and self.organ_path.endswith(".stl"):
+        if self.tumor_path and self.organ_paths and self.tumor_path.endswith(".stl") and all(path.endswith(".stl") for path in self.organ_paths):
             self.computation_button.setEnabled(True)
         else:
             self.computation_button.setEnabled(False)
@@ -110,10 +173,16 @@ class FileSelectionWindow(QMainWindow):
         self.tumor_button.setEnabled(False)
         self.organ_button.setEnabled(False)
         self.computation_button.setEnabled(False)
-
-        self.computation_thread = ComputationThread(self.tumor_path, self.organ_path)
-        self.computation_thread.status_updated.connect(self.update_status_label)
+        self.timeout_box.setEnabled(False)
+        self.open_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.cancel_button.setVisible(True)
+
+        timeout = self.timeout_box.value() if self.timeout_box.value() > 0 else None
+        self.computation_thread = ComputationThread(self.tumor_path, self.organ_paths, self.executor, timeout)
+        self.computation_thread.progress_updated.connect(self.update_progress)
         self.computation_thread.computation_finished.connect(self.computation_completed)
+        self.computation_thread.computation_failed.connect(self.computation_stopped)
         self.computation_thread.start()
 
         self.timer.start(100)
@@ -122,15 +191,42 @@ class FileSelectionWindow(QMainWindow):
         # Process any pending events (including signals from the computation thread)
         app.processEvents()
 
-    def update_status_label(self, status_message):
-        self.text_box.setText(status_message)
+    def update_progress(self, event):
+        if event["event"] == "stage_start":
+            self.stage_message = event["message"]
+            self.progress_bar.setVisible(True)
+        if event["event"] in ("stage_start", "progress"):
+            self.text_box.setText(describe(event, self.stage_message))
+        if event.get("overall") is not None:
+            self.progress_bar.setValue(int(1000*event["overall"]))
+        elif event["event"] == "stage_start" and event["index"] is not None:
+            self.progress_bar.setValue(int(1000*event["index"]/event["stages"]))
+
+    def cancel_computation(self):
+        self.cancel_button.setEnabled(False)
+        self.text_box.setText("Cancelling...")
+        self.computation_thread.cancel()
+
+    def computation_stopped(self, message):
+        self.timer.stop()
+        self.text_box.setText(message)
+        self.progress_bar.setVisible(False)
+        self.cancel_button.setVisible(False)
+        self.tumor_button.setEnabled(True)
+        self.organ_button.setEnabled(True)
+        self.timeout_box.setEnabled(True)
+        self.open_button.setEnabled(True)
+        self.check_files_selected()
 
     def computation_completed(self, csa):
         self.timer.stop()
         self.open_results_window(csa)
 
     def open_results_window(self, result):
-        self.results_window = ResultsWindow(result)
+        if isinstance(result, MultiContactSurfaceArea):
+            self.results_window = MultiResultsWindow(result)
+        else:
+            self.results_window = ResultsWindow(result)
         self.results_window.show()
         self.close()
 
@@ -179,12 +275,12 @@ class ResultsWindow(QMainWindow):
         self.label1.setAlignment(Qt.AlignCenter)  # Center align the label
         self.text_info_layout.addWidget(self.label1)
 
-        if(csa.get_name_obj_p() == "tumor"):
-            area = csa.get_area_obj_p()
-            volume = csa.get_volume_obj_p()
-        else:
-            area = csa.get_area_obj_q()
-            volume = csa.get_volume_obj_q()
+        # metrics are computed with the result in the worker, nothing is computed here
+        metrics = csa.get_metrics()
+        # metrics of object_p then object_q, the tumor is found by name or else taken as object_p
+        tumor = next((mesh for mesh in metrics["meshes"] if mesh["name"] == "tumor"), metrics["meshes"][0])
+        area = tumor["area"]
+        volume = tumor["volume"]
 
 
         self.add_title_label("Tumor Area")
@@ -197,6 +293,34 @@ class ResultsWindow(QMainWindow):
         self.label3.setAlignment(Qt.AlignCenter)
         self.text_info_layout.addWidget(self.label3)
 
+        self.add_title_label("CSA Fraction / Patches")
+        self.label4 = self.add_info_label(self.text_info_container, self.patches_text(metrics))
+
+        # Threshold slider, from 0 to the soft threshold: the CSA and the highlighted faces follow it
+        self.csa = csa
+        self.add_title_label("Contact Threshold")
+        self.threshold_label = self.add_info_label(self.text_info_container, "%.4f" % csa.get_threshold())
+        self.threshold_slider = QSlider(Qt.Horizontal, self.text_info_container)
+        self.threshold_slider.setRange(0, 1000)
+        self.threshold_slider.setValue(self.threshold_to_slider(csa.get_threshold()))
+        self.threshold_slider.valueChanged.connect(self.threshold_changed)
+        self.text_info_layout.addWidget(self.threshold_slider)
+        self.automatic_button = QPushButton("Automatic Threshold", self.text_info_container)
+        self.automatic_button.clicked.connect(self.automatic_threshold)
+        self.automatic_button.setEnabled(csa.get_manual_threshold() is not None)
+        self.text_info_layout.addWidget(self.automatic_button)
+
+        self.lod_box = QCheckBox("Decimate While Moving", self.text_info_container)
+        self.lod_box.setChecked(True)
+        self.text_info_layout.addWidget(self.lod_box)
+        self.colormap_box = QCheckBox("Distance Colormap", self.text_info_container)
+        self.colormap_box.toggled.connect(self.colormap_changed)
+        self.text_info_layout.addWidget(self.colormap_box)
+
+        self.save_button = QPushButton("Save Result", self.text_info_container)
+        self.save_button.clicked.connect(self.save_result)
+        self.text_info_layout.addWidget(self.save_button)
+
         self.text_info_container.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
 
         self.label1.setText(str(csa.get_csa()))
@@ -204,38 +328,20 @@ class ResultsWindow(QMainWindow):
         self.label3.setText(str(volume))
 
         obj_p_m, obj_q_m, csa_m = csa.display()
+        self.obj_p_points = obj_p_m.GetPoints()
         
-        obj_p_mapper = vtkRenderingCore.vtkPolyDataMapper()
-        obj_p_mapper.SetInputData(obj_p_m)
-
-        obj_q_mapper = vtkRenderingCore.vtkPolyDataMapper()
-        obj_q_mapper.SetInputData(obj_q_m)
-
-        csa_mapper = vtkRenderingCore.vtkPolyDataMapper()
-        csa_mapper.SetInputData(csa_m)
-
-        obj_p_actor = vtkRenderingCore.vtkActor()
-        obj_p_actor.SetMapper(obj_p_mapper)
-        obj_p_actor.GetProperty().SetColor(1.0, 0.0, 0.0)
-        obj_p_actor.GetProperty().SetOpacity(1.0)
-
-        obj_q_actor = vtkRenderingCore.vtkActor()
-        obj_q_actor.SetMapper(obj_q_mapper)
-        obj_q_actor.GetProperty().SetColor(0.0, 1.0, 0.0)
-        obj_q_actor.GetProperty().SetOpacity(1.0)
-
-        csa_actor = vtkRenderingCore.vtkActor()
-        csa_actor.SetMapper(csa_mapper)
-        csa_actor.GetProperty().SetColor(0.0, 0.0, 1.0)
-        csa_actor.GetProperty().SetOpacity(1.0)
+        # Each renderer gets its own CSA actor so that both views can switch to their proxies independently
+        self.obj_p_actor = LODActor(obj_p_m, (1.0, 0.0, 0.0))
+        self.obj_q_actor = LODActor(obj_q_m, (0.0, 1.0, 0.0))
+        self.csa_actors = [LODActor(csa_m, (0.0, 0.0, 1.0)), LODActor(csa_m, (0.0, 0.0, 1.0))]
 
         renderer1 = vtkRenderingCore.vtkRenderer()
-        renderer1.AddActor(obj_p_actor)
-        renderer1.AddActor(csa_actor)
+        renderer1.AddActor(self.obj_p_actor.actor)
+        renderer1.AddActor(self.csa_actors[0].actor)
 
         renderer2 = vtkRenderingCore.vtkRenderer()
-        renderer2.AddActor(obj_q_actor)
-        renderer2.AddActor(csa_actor)
+        renderer2.AddActor(self.obj_q_actor.actor)
+        renderer2.AddActor(self.csa_actors[1].actor)
 
         
         left_render_window =self.vtk_widget1.GetRenderWindow()
@@ -249,11 +355,11 @@ class ResultsWindow(QMainWindow):
 
         # Enable interactor
         self.interactor1 = left_render_window.GetInteractor()
-        self.interactor1.SetInteractorStyle(vtk.vtkInteractorStyleTrackballCamera())
+        self.interactor1.SetInteractorStyle(self.lod_style([self.obj_p_actor, self.csa_actors[0]], left_render_window))
         self.interactor1.Initialize()
 
         self.interactor2 = right_render_window.GetInteractor()
-        self.interactor2.SetInteractorStyle(vtk.vtkInteractorStyleTrackballCamera())
+        self.interactor2.SetInteractorStyle(self.lod_style([self.obj_q_actor, self.csa_actors[1]], right_render_window))
         self.interactor2.Initialize()
 
         # Show the ResultsWindow
@@ -264,6 +370,72 @@ class ResultsWindow(QMainWindow):
         icon_path = os.path.join(icon_dir, "../resources/logo.png")
         self.setWindowIcon(QIcon(icon_path))
 
+    #Trackball style switching the actors to their proxies while the camera moves
+    def lod_style(self, actors, render_window):
+        def interaction(interacting):
+            if self.lod_box.isChecked() or not interacting:
+                for actor in actors:
+                    actor.set_interacting(interacting)
+            if not interacting:
+                render_window.Render()
+
+        style = vtkInteractorStyleTrackballCamera()
+        style.AddObserver("StartInteractionEvent", lambda obj, event: interaction(True))
+        style.AddObserver("EndInteractionEvent", lambda obj, event: interaction(False))
+        return style
+
+    #CSA faces coloured by their distance to the other object, from 0 (red) to the threshold (blue)
+    def colormap_changed(self, checked=None):
+        scalar_range = (0.0, max(self.csa.get_threshold(), 1e-6)) if self.colormap_box.isChecked() else None
+        for actor in self.csa_actors:
+            actor.set_colormap("distance" if scalar_range is not None else None, scalar_range)
+        self.vtk_widget1.GetRenderWindow().Render()
+        self.vtk_widget2.GetRenderWindow().Render()
+
+    #Fraction of the object_p area in contact and the area of each patch
+    def patches_text(self, metrics):
+        return "%.1f%% / %s" % (100*metrics["csa_fraction"], ", ".join("%.1f" % area for area in metrics["patch_areas"]) or "-")
+
+    def threshold_to_slider(self, threshold):
+        return int(round(1000*min(threshold/self.csa.get_soft_threshold(), 1.0)))
+
+    def threshold_changed(self, value):
+        self.csa.set_threshold(value*self.csa.get_soft_threshold()/1000)
+        self.automatic_button.setEnabled(True)
+        self.update_csa()
+
+    def automatic_threshold(self):
+        self.csa.set_threshold(None)
+        self.threshold_slider.blockSignals(True)
+        self.threshold_slider.setValue(self.threshold_to_slider(self.csa.get_threshold()))
+        self.threshold_slider.blockSignals(False)
+        self.automatic_button.setEnabled(False)
+        self.update_csa()
+
+    #The result is saved with the current threshold, as shown
+    def save_result(self):
+        file_dialog = QFileDialog()
+        file_path, _ = file_dialog.getSaveFileName(self, "Save Result", "", RESULT_FILTER)
+        if file_path:
+            if not file_path.endswith(RESULT_EXTENSION):
+                file_path += RESULT_EXTENSION
+            try:
+                self.csa.save(file_path)
+            except OSError as e:
+                self.save_button.setText("Save Result (failed: %s)" % e.strerror)
+                return
+            self.save_button.setText("Save Result (saved)")
+
+    #Only the CSA faces are rebuilt, the distances and both meshes are kept
+    def update_csa(self):
+        self.label1.setText(str(self.csa.get_csa()))
+        self.label4.setText(self.patches_text(self.csa.get_metrics()))
+        self.threshold_label.setText("%.4f" % self.csa.get_threshold())
+        csa_m = self.csa.csa_polydata(self.obj_p_points)
+        for actor in self.csa_actors:
+            actor.set_polydata(csa_m)
+        self.colormap_changed()
+
     def add_title_label(self, title):
         label = QLabel(title, self.text_info_container)
         label.setAlignment(Qt.AlignCenter)  # Center align the label
@@ -294,10 +466,111 @@ class ResultsWindow(QMainWindow):
         # Call the superclass closeEvent to perform other necessary cleanup
         super().closeEvent(event)
         
+#Colours of the organs and of their contact patches in the multi-organ results
+ORGAN_COLORS = [(0.0, 0.0, 1.0), (1.0, 0.8, 0.0), (0.0, 0.8, 0.8), (0.8, 0.0, 0.8), (1.0, 0.5, 0.0), (0.5, 0.3, 0.1)]
+
+#Results of a MultiContactSurfaceArea: the tumor with the patch of each organ on the left,
+#the organs with the same patches on the right, and the CSA of each organ
+class MultiResultsWindow(QMainWindow):
+    def __init__(self, csa):
+        super().__init__()
+        self.setWindowTitle("Results")
+        self.setGeometry(100, 100, 800, 600)
+
+        self.central_widget = QWidget(self)
+        self.setCentralWidget(self.central_widget)
+
+        self.grid_layout = QGridLayout(self.central_widget)
+        self.grid_layout.setVerticalSpacing(0)
+
+        self.vtk_widget1 = QVTKRenderWindowInteractor(self.central_widget)
+        self.vtk_widget2 = QVTKRenderWindowInteractor(self.central_widget)
+        self.text_info_container = QWidget(self.central_widget)
+        self.text_info_layout = QVBoxLayout(self.text_info_container)
+        self.text_info_layout.setSpacing(0)
+        self.text_info_layout.setContentsMargins(0, 0, 0, 0)
+
+        self.grid_layout.addWidget(self.vtk_widget1, 0, 0)
+        self.grid_layout.addWidget(self.vtk_widget2, 0, 1)
+        self.grid_layout.addWidget(self.text_info_container, 0, 2)
+
+        self.setWindowIcon(QIcon(os.path.join(os.path.dirname(__file__), "../resources/logo.png")))
+
+        for i, (name, area) in enumerate(zip(csa.get_organ_names(), csa.get_csa())):
+            title = self.add_label("Contact Surface Area - " + name, True)
+            color = ORGAN_COLORS[i % len(ORGAN_COLORS)]
+            title.setStyleSheet("font-weight: bold; color: rgb(%d, %d, %d);" % tuple(int(255*c) for c in color))
+            self.add_label(str(area))
+        self.add_label("Tumor Area", True)
+        self.add_label(str(csa.get_area_tumor()))
+        self.add_label("Tumor Volume", True)
+        self.add_label(str(csa.get_volume_tumor()))
+        self.text_info_container.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
+
+        tumor_m, organs_m, csa_m = csa.display()
+        self.tumor_actor = LODActor(tumor_m, (1.0, 0.0, 0.0))
+        self.organ_actors = []
+        self.csa_actors = [[], []]
+        renderer1 = vtkRenderingCore.vtkRenderer()
+        renderer2 = vtkRenderingCore.vtkRenderer()
+        renderer1.AddActor(self.tumor_actor.actor)
+        for i, (organ_m, patch_m) in enumerate(zip(organs_m, csa_m)):
+            color = ORGAN_COLORS[i % len(ORGAN_COLORS)]
+            organ_actor = LODActor(organ_m, (0.0, 1.0, 0.0))
+            organ_actor.actor.GetProperty().SetOpacity(0.5 if len(organs_m) > 1 else 1.0)
+            self.organ_actors.append(organ_actor)
+            renderer2.AddActor(organ_actor.actor)
+            for actors, renderer in zip(self.csa_actors, (renderer1, renderer2)):
+                actors.append(LODActor(patch_m, color))
+                renderer.AddActor(actors[-1].actor)
+
+        self.vtk_widget1.GetRenderWindow().AddRenderer(renderer1)
+        self.vtk_widget2.GetRenderWindow().AddRenderer(renderer2)
+
+        self.interactor1 = self.vtk_widget1.GetRenderWindow().GetInteractor()
+        self.interactor1.SetInteractorStyle(self.lod_style([self.tumor_actor] + self.csa_actors[0], self.vtk_widget1.GetRenderWindow()))
+        self.interactor1.Initialize()
+
+        self.interactor2 = self.vtk_widget2.GetRenderWindow().GetInteractor()
+        self.interactor2.SetInteractorStyle(self.lod_style(self.organ_actors + self.csa_actors[1], self.vtk_widget2.GetRenderWindow()))
+        self.interactor2.Initialize()
+
+        self.showMaximized()
+
+    def lod_style(self, actors, render_window):
+        def interaction(interacting):
+            for actor in actors:
+                actor.set_interacting(interacting)
+            if not interacting:
+                render_window.Render()
+
+        style = vtkInteractorStyleTrackballCamera()
+        style.AddObserver("StartInteractionEvent", lambda obj, event: interaction(True))
+        style.AddObserver("EndInteractionEvent", lambda obj, event: interaction(False))
+        return style
+
+    def add_label(self, text, title=False):
+        label = QLabel(text, self.text_info_container)
+        label.setAlignment(Qt.AlignCenter)
+        if title:
+            label.setStyleSheet("font-weight: bold;")
+        self.text_info_layout.addWidget(label)
+        return label
+
+    def closeEvent(self, event):
+        for widget, interactor in ((self.vtk_widget1, self.interactor1), (self.vtk_widget2, self.interactor2)):
+            widget.GetRenderWindow().Finalize()
+            interactor.TerminateApp()
+        self.interactor1 = None
+        self.interactor2 = None
+        super().closeEvent(event)
+
 if __name__ == '__main__':
     multiprocessing.freeze_support()
     app = QApplication(sys.argv)
-    file_selection_window = FileSelectionWindow()
+    executor = ComputeExecutor(workers=1)
+    app.aboutToQuit.connect(lambda: executor.shutdown(wait=False))
+    file_selection_window = FileSelectionWindow(executor)
     file_selection_window.show()
     sys.exit(app.exec_())
 
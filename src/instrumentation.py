@@ -0,0 +1,102 @@
+import json, time
+from contextlib import contextmanager
+
+class ComputationCancelled(Exception):
+    pass
+
+#Structured events of a computation, sent to every sink (any callable taking the event dict):
+#  {"event": "stage_start", "stage", "message", "index", "stages", "time"}
+#  {"event": "progress", "stage", "done", "total", "fraction", "overall", "elapsed", "eta", "time"}
+#  {"event": "stage_end", "stage", "duration", "items", "time"}
+#index/stages place the stage in the pipeline, overall is the fraction of the whole pipeline.
+#Progress events are sent at most every min_interval seconds, except the last one of a stage.
+#cancelled, if given, is polled at every stage and progress report: once it returns True the
+#computation is stopped by raising ComputationCancelled.
+class Instrumentation:
+    def __init__(self, stages=(), sinks=(), min_interval=0.1, cancelled=None):
+        self.__stages = tuple(stages)
+        self.__sinks = list(sinks)
+        self.__min_interval = min_interval
+        self.__cancelled = cancelled
+        self.__stage = None
+        self.__start = None
+        self.__items = 0
+        self.__last_progress = 0
+
+    def add_sink(self, sink):
+        self.__sinks.append(sink)
+
+    def set_stages(self, stages):
+        self.__stages = tuple(stages)
+
+    def check_cancelled(self):
+        if self.__cancelled is not None and self.__cancelled():
+            raise ComputationCancelled("Computation cancelled")
+
+    def emit(self, event):
+        event["time"] = time.time()
+        for sink in self.__sinks:
+            sink(event)
+
+    def __index(self, stage):
+        return self.__stages.index(stage) if stage in self.__stages else None
+
+    @contextmanager
+    def stage(self, name, message=None):
+        self.check_cancelled()
+        previous = (self.__stage, self.__start, self.__items)
+        self.__stage = name
+        self.__start = time.perf_counter()
+        self.__items = 0
+        self.__last_progress = 0
+        self.emit({"event": "stage_start", "stage": name, "message": message if message is not None else name, "index": self.__index(name), "stages": len(self.__stages)})
+        try:
+            yield self
+        finally:
+            self.emit({"event": "stage_end", "stage": name, "duration": time.perf_counter() - self.__start, "items": self.__items})
+            self.__stage, self.__start, self.__items = previous
+
+    #done out of total items (e.g. faces) of the current stage are processed
+    def progress(self, done, total):
+        self.check_cancelled()
+        if self.__stage is None or total <= 0:
+            return
+        self.__items = done
+        now = time.perf_counter()
+        if done < total and now - self.__last_progress < self.__min_interval:
+            return
+        self.__last_progress = now
+
+        fraction = min(float(done)/total, 1.0)
+        elapsed = now - self.__start
+        index = self.__index(self.__stage)
+        self.emit({
+            "event": "progress",
+            "stage": self.__stage,
+            "done": done,
+            "total": total,
+            "fraction": fraction,
+            "overall": (index + fraction)/len(self.__stages) if index is not None else None,
+            "elapsed": elapsed,
+            "eta": elapsed*(1 - fraction)/fraction if fraction > 0 else None,
+        })
+
+#Sink appending the events to a JSON lines file for offline profiling
+class JsonTraceSink:
+    def __init__(self, path):
+        self.__path = path
+
+    def __call__(self, event):
+        with open(self.__path, "a") as f:
+            f.write(json.dumps(event) + "\n")
+
+#Text for a status label, e.g. "Computing distances! 42% (ETA 3 s)"
+def describe(event, message=""):
+    if event["event"] == "stage_start":
+        return event["message"]
+    if event["event"] == "progress":
+        text = "%s %d%%" % (message, round(100*event["fraction"]))
+        if event["eta"] is not None and event["fraction"] < 1:
+            text += " (ETA %d s)" % round(event["eta"])
+        return text.strip()
+    return message
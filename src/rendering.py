@@ -0,0 +1,91 @@
+import numpy as np
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.util import numpy_support
+
+#VTK side of the meshes and results, imported only when something is displayed so that the
+#computation (batch jobs, executor workers) never loads the rendering modules.
+
+#vtkPolyData viewing the vertex and face arrays without copies. points, the vtkPoints of
+#another polydata of the same vertices, is shared instead of wrapping the vertices again.
+def mesh_polydata(vertices, faces, points=None):
+    if points is None:
+        points = vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(vertices, deep=False))
+
+    connectivity = np.ascontiguousarray(faces).ravel()
+    offsets = np.arange(0, connectivity.shape[0]+1, 3, dtype=np.int32)
+    cells = vtkCellArray()
+    if not cells.SetData(numpy_support.numpy_to_vtk(offsets, deep=False), numpy_support.numpy_to_vtk(connectivity, deep=False)):
+        # VTK builds without 32 bit cell storage need vtkIdType arrays
+        cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(offsets.astype(np.int64), deep=True), numpy_support.numpy_to_vtkIdTypeArray(connectivity.astype(np.int64), deep=True))
+
+    polydata = vtkPolyData()
+    polydata.SetPoints(points)
+    polydata.SetPolys(cells)
+    return polydata
+
+#Adds a named per-face array; without deep the values must outlive the polydata
+def add_cell_array(polydata, name, values, deep=False):
+    array = numpy_support.numpy_to_vtk(np.ascontiguousarray(values), deep=deep)
+    array.SetName(name)
+    polydata.GetCellData().AddArray(array)
+    return array
+
+LOD_FACES = 100000 # meshes above this many faces are decimated while the camera moves
+
+#Proxy of a polydata with about faces triangles, by clustering the vertices on a regular grid
+def decimate(polydata, faces=LOD_FACES):
+    from vtkmodules.vtkFiltersCore import vtkQuadricClustering
+    divisions = max(int(round((faces/2)**0.5)), 2)
+    clustering = vtkQuadricClustering()
+    clustering.SetInputData(polydata)
+    clustering.SetNumberOfDivisions(divisions, divisions, divisions)
+    clustering.CopyCellDataOn()
+    clustering.Update()
+    return clustering.GetOutput()
+
+#Actor drawing a polydata at full resolution at rest and a decimated proxy, built on the
+#first interaction, while the camera moves
+class LODActor:
+    def __init__(self, polydata, color):
+        from vtkmodules.vtkRenderingCore import vtkPolyDataMapper, vtkActor
+        self.mapper = vtkPolyDataMapper()
+        self.proxy_mapper = vtkPolyDataMapper()
+        for mapper in (self.mapper, self.proxy_mapper):
+            mapper.ScalarVisibilityOff()
+        self.actor = vtkActor()
+        self.actor.SetMapper(self.mapper)
+        self.actor.GetProperty().SetColor(*color)
+        self.actor.GetProperty().SetOpacity(1.0)
+        self.set_polydata(polydata)
+
+    def set_polydata(self, polydata):
+        self.polydata = polydata
+        self.proxy = None
+        self.mapper.SetInputData(polydata)
+
+    def set_interacting(self, interacting):
+        if interacting and self.polydata.GetNumberOfCells() > LOD_FACES:
+            if self.proxy is None:
+                self.proxy = decimate(self.polydata)
+                self.proxy_mapper.SetInputData(self.proxy)
+            self.actor.SetMapper(self.proxy_mapper)
+        else:
+            self.actor.SetMapper(self.mapper)
+
+    #Colours the faces by a cell array, or with the actor colour when array is None
+    def set_colormap(self, array, scalar_range=None):
+        from vtkmodules.vtkRenderingCore import vtkColorTransferFunction
+        for mapper in (self.mapper, self.proxy_mapper):
+            if array is None:
+                mapper.ScalarVisibilityOff()
+                continue
+            lookup_table = vtkColorTransferFunction()
+            lookup_table.AddRGBPoint(scalar_range[0], 1.0, 0.0, 0.0)
+            lookup_table.AddRGBPoint(scalar_range[1], 0.0, 0.0, 1.0)
+            mapper.SetLookupTable(lookup_table)
+            mapper.SetScalarModeToUseCellFieldData()
+            mapper.SelectColorArray(array)
+            mapper.SetScalarRange(*scalar_range)
+            mapper.ScalarVisibilityOn()
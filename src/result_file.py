@@ -0,0 +1,75 @@
+import json, os, struct, tempfile
+import numpy as np
+
+#Single file holding a computed result: the magic bytes, the format version and the length
+#of a JSON header, the header, then the arrays, each starting on an ALIGNMENT bytes boundary.
+#The header gives the dtype, shape and offset of every array, so that the file can be
+#memory mapped and the arrays viewed in place.
+MAGIC = b"\x89CSA\r\n\x1a\n"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+PREFIX = struct.Struct("<8sHI")
+
+def _aligned(offset):
+    return -(-offset//ALIGNMENT)*ALIGNMENT
+
+#bytes of the file for a JSON serializable header and a dictionary of arrays
+def pack_result(header, arrays):
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+
+    # the array offsets are stored relative to the end of the header, whose length they do not change
+    text = json.dumps(dict(header, version=FORMAT_VERSION, arrays=layout)).encode("utf-8")
+    start = _aligned(PREFIX.size + len(text))
+    data = bytearray(start + offset)
+    PREFIX.pack_into(data, 0, MAGIC, FORMAT_VERSION, len(text))
+    data[PREFIX.size:PREFIX.size+len(text)] = text
+    for name, array in arrays.items():
+        position = start + layout[name]["offset"]
+        data[position:position+array.nbytes] = array.tobytes()
+    return bytes(data)
+
+#Header and arrays of a file held in any buffer (bytes, memory map); the arrays are read-only
+#views of the buffer
+def unpack_result(buffer):
+    buffer = memoryview(buffer).cast("B")
+    if buffer.nbytes < PREFIX.size:
+        raise ValueError("Not a result file")
+    magic, version, length = PREFIX.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a result file")
+    if version > FORMAT_VERSION:
+        raise ValueError("Result file version %d is newer than the supported version %d" % (version, FORMAT_VERSION))
+
+    header = json.loads(bytes(buffer[PREFIX.size:PREFIX.size+length]).decode("utf-8"))
+    start = _aligned(PREFIX.size + length)
+    arrays = {}
+    for name, entry in header.pop("arrays").items():
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=start + entry["offset"]).reshape(entry["shape"])
+    return header, arrays
+
+#Written to a temporary file first, so that an interrupted save never leaves a partial file
+def write_result(path, header, arrays):
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(pack_result(header, arrays))
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+#The arrays stay views of the memory mapped file unless mmap is False
+def read_result(path, mmap=True):
+    if mmap and os.path.getsize(path) > 0:
+        return unpack_result(np.memmap(path, dtype=np.uint8, mode="r"))
+    with open(path, "rb") as f:
+        return unpack_result(f.read())
@@ -0,0 +1,104 @@
+import argparse, sys, time
+from collections import OrderedDict
+
+from csa import Mesh3D, ContactSurfaceArea, SOFT_THRESHOLD
+from cache import file_hash
+from distance import DISTANCE_ENGINES, DEFAULT_DISTANCE_ENGINE, get_distance_engine, engine_signature
+from batch import ResultWriter
+
+TREND_FIELDS = ["timepoint", "tumor", "csa", "tumor_area", "tumor_volume", "threshold", "csa_change", "area_change", "volume_change", "seconds", "error"]
+
+#Loaded meshes and their spatial indexes, kept across computations and looked up by file
+#content hash: a mesh shared by several computations (e.g. the organ of a follow-up series)
+#is parsed, welded and indexed once. The least recently used meshes beyond max_meshes are dropped.
+class MeshSession:
+    def __init__(self, distance_engine=None, search_radius=None, max_meshes=8):
+        self.__distance_engine = get_distance_engine(distance_engine, search_radius)
+        self.__max_meshes = max_meshes
+        self.__meshes = OrderedDict()
+        self.__indexes = {}
+
+    def get_distance_engine(self):
+        return self.__distance_engine
+
+    def load(self, path, name):
+        key = (file_hash(path), name)
+        if key in self.__meshes:
+            self.__meshes.move_to_end(key)
+        else:
+            self.__meshes[key] = Mesh3D(path, name)
+            while len(self.__meshes) > self.__max_meshes:
+                self.__meshes.popitem(last=False)
+        return self.__meshes[key]
+
+    #Spatial index of a mesh for the distance engine, None for engines without one
+    def index(self, mesh):
+        if not hasattr(self.__distance_engine, "build"):
+            return None
+        key = (file_hash(mesh.get_path()), engine_signature(self.__distance_engine))
+        if key not in self.__indexes:
+            if len(self.__indexes) >= self.__max_meshes:
+                self.__indexes.pop(next(iter(self.__indexes)))
+            self.__indexes[key] = self.__distance_engine.build(mesh)
+        return self.__indexes[key]
+
+    #The tumor is always the query object, as in MultiContactSurfaceArea, so that only the
+    #organ is indexed and its index is reused by every tumor computed against it
+    def contact(self, path_tumor, name_tumor, path_organ, name_organ, **options):
+        csa = ContactSurfaceArea(self.load(path_tumor, name_tumor), name_tumor, self.load(path_organ, name_organ), name_organ, distance_engine=self.__distance_engine, index=self.index, query_first=True, **options)
+        csa.compute()
+        return csa
+
+#CSA, tumor area and volume of each tumor timepoint against the same organ, with the change
+#from the previous timepoint. Rows are yielded as the timepoints are computed.
+def run_timepoints(organ_path, tumor_paths, session=None, **options):
+    session = session if session is not None else MeshSession()
+    previous = None
+    for timepoint, tumor_path in enumerate(tumor_paths):
+        row = {"timepoint": timepoint, "tumor": tumor_path, "error": ""}
+        start = time.perf_counter()
+        try:
+            csa = session.contact(tumor_path, "tumor", organ_path, "organ", **options)
+            row.update({"csa": csa.get_csa(), "tumor_area": csa.get_area_obj_p(), "tumor_volume": csa.get_volume_obj_p(), "threshold": csa.get_threshold()})
+            if previous is not None:
+                row.update({
+                    "csa_change": row["csa"] - previous["csa"],
+                    "area_change": row["tumor_area"] - previous["tumor_area"],
+                    "volume_change": row["tumor_volume"] - previous["tumor_volume"],
+                })
+            previous = row
+        except Exception as e:
+            row["error"] = "%s: %s" % (type(e).__name__, e)
+        row["seconds"] = time.perf_counter() - start
+        yield row
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Contact surface area of a series of tumor scans against the same organ.")
+    parser.add_argument("organ", help="organ STL file, loaded and indexed once")
+    parser.add_argument("tumors", nargs="+", help="tumor STL files in timepoint order")
+    parser.add_argument("-o", "--output", default="trend.csv", help="results file, CSV if it ends in .csv, JSON lines otherwise")
+    parser.add_argument("--engine", choices=sorted(DISTANCE_ENGINES), default=DEFAULT_DISTANCE_ENGINE, help="distance engine")
+    parser.add_argument("--search-radius", type=float, default=None, help="faces farther than this are out of contact, at least the soft threshold of the fit (%d)" % SOFT_THRESHOLD)
+    args = parser.parse_args(argv)
+    if args.search_radius is not None and args.search_radius < SOFT_THRESHOLD:
+        parser.error("--search-radius must be at least the soft threshold (%d)" % SOFT_THRESHOLD)
+
+    log = lambda message: print(message, file=sys.stderr, flush=True)
+    session = MeshSession(args.engine, args.search_radius)
+    writer = ResultWriter(args.output, fields=TREND_FIELDS)
+    failed = 0
+    try:
+        for row in run_timepoints(args.organ, args.tumors, session):
+            writer.write(row)
+            if row["error"]:
+                failed += 1
+                log("[%d] %s: %s" % (row["timepoint"], row["tumor"], row["error"]))
+            else:
+                change = " (%+.4f)" % row["csa_change"] if "csa_change" in row else ""
+                log("[%d] %s: CSA %.4f%s, area %.4f, volume %.4f (%.2f s)" % (row["timepoint"], row["tumor"], row["csa"], change, row["tumor_area"], row["tumor_volume"], row["seconds"]))
+    finally:
+        writer.close()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+
+# Binary STL: 80 bytes header, uint32 triangle count, then one 50 bytes record per triangle
+STL_HEADER_SIZE = 84
+STL_RECORD = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vectors', '<f4', (3,3)),
+    ('attr', '<u2'),
+])
+
+CHUNK_SIZE = 1 << 18
+
+#Triangle records of an STL file. Binary files are memory mapped and returned as a
+#read-only structured view, nothing is loaded until the records are accessed.
+#ASCII files are parsed with numpy-stl.
+def read_stl(path):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.read(STL_HEADER_SIZE)
+
+    if len(header) == STL_HEADER_SIZE:
+        count = int(np.frombuffer(header, dtype='<u4', offset=80)[0])
+        expected = STL_HEADER_SIZE + count*STL_RECORD.itemsize
+        if size == expected or (size > expected and not header.startswith(b'solid')):
+            if count == 0:
+                return np.zeros(0, dtype=STL_RECORD)
+            return np.memmap(path, dtype=STL_RECORD, mode='r', offset=STL_HEADER_SIZE, shape=(count,))
+
+    if header.startswith(b'solid'):
+        from stl import mesh
+        stl_mesh = mesh.Mesh.from_file(path)
+        records = np.zeros(stl_mesh.vectors.shape[0], dtype=STL_RECORD)
+        records['normal'] = stl_mesh.normals
+        records['vectors'] = stl_mesh.vectors
+        return records
+
+    raise ValueError("Truncated or invalid STL file: " + str(path))
+
+def chunks(n, chunk_size=CHUNK_SIZE):
+    for start in range(0, n, chunk_size):
+        yield start, min(start + chunk_size, n)
+
+#Centroids, unit normals (from the vertex winding) and areas of the triangles, computed
+#chunk by chunk so that only chunk_size triangles are materialized at a time
+def triangle_properties(vectors, chunk_size=CHUNK_SIZE):
+    n = vectors.shape[0]
+    centroids = np.empty((n,3), dtype=np.float32)
+    normals = np.empty((n,3), dtype=np.float32)
+    areas = np.empty(n, dtype=np.float64)
+
+    for start, stop in chunks(n, chunk_size):
+        triangles = np.asarray(vectors[start:stop])
+        v0 = triangles[:,0]
+        v1 = triangles[:,1]
+        v2 = triangles[:,2]
+        centroids[start:stop] = (v0 + v1 + v2)/3
+
+        v0 = v0.astype(np.float64)
+        cross = np.cross(v1-v0, v2-v0)
+        norm = np.linalg.norm(cross, axis=1)
+        areas[start:stop] = norm/2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normals[start:stop] = np.nan_to_num(cross/norm[:,None])
+
+    return centroids, normals, areas
@@ -0,0 +1,130 @@
+import glob, os, sys
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from csa import Mesh3D, ContactSurfaceArea, find_threshold, SOFT_THRESHOLD
+from connectivity import face_components
+from distance import BruteForceDistance, KDTreeDistance, TiledDistance, SurfaceDistance, point_triangle_distance
+from result_file import pack_result, unpack_result
+
+CASES = ["1", "5", "17"]
+
+def case_meshes(case):
+    folder = os.path.join(ROOT, "benchmark", case)
+    tumor = Mesh3D(glob.glob(os.path.join(folder, "*tumor.stl"))[0], "tumor")
+    organ = Mesh3D(glob.glob(os.path.join(folder, "*organ.stl"))[0], "organ")
+    return tumor, organ
+
+#UV sphere, closed and welded
+def sphere(center, radius, rings=24, sectors=48, name="sphere"):
+    theta = np.linspace(0, np.pi, rings+1)[1:-1]
+    phi = np.linspace(0, 2*np.pi, sectors, endpoint=False)
+    t, p = np.meshgrid(theta, phi, indexing="ij")
+    ring = np.stack((np.sin(t)*np.cos(p), np.sin(t)*np.sin(p), np.cos(t)), axis=-1).reshape(-1, 3)
+    vertices = np.concatenate(([[0, 0, 1]], ring, [[0, 0, -1]]))*radius + center
+    last = vertices.shape[0] - 1
+
+    faces = []
+    for j in range(sectors):
+        k = (j+1) % sectors
+        faces.append((0, 1+j, 1+k))
+        for i in range(rings-2):
+            a, b = 1 + i*sectors + j, 1 + i*sectors + k
+            faces += [(a, a+sectors, b+sectors), (a, b+sectors, b)]
+        faces.append((last, 1 + (rings-2)*sectors + k, 1 + (rings-2)*sectors + j))
+    return Mesh3D.from_arrays(vertices.astype(np.float32), np.array(faces, dtype=np.int32), name)
+
+def synthetic_pair():
+    return sphere((0, 0, 0), 10, name="tumor"), sphere((24, 0, 0), 15, rings=32, sectors=64, name="organ")
+
+def pairs():
+    return [case_meshes(case) for case in CASES] + [synthetic_pair()]
+
+#The threshold scan before the prefix sums: two np.polyfit lines per split
+def polyfit_threshold(data_to_fit):
+    x = np.arange(data_to_fit.shape[0])
+    distance = np.empty(data_to_fit.shape[0])
+    distance[:] = np.inf
+    for i in range(2, data_to_fit.shape[0]-2):
+        first = data_to_fit[:i]
+        second = data_to_fit[i:-1]
+        p1 = np.poly1d(np.polyfit(x[:i], first, 1))
+        p2 = np.poly1d(np.polyfit(x[i:-1], second, 1))
+        distance[i] = np.linalg.norm(first-p1(x[:i])) + np.linalg.norm(second-p2(x[i:-1]))
+    return data_to_fit[np.argmin(distance)]
+
+@pytest.mark.parametrize("pair", range(len(CASES)+1))
+def test_find_threshold_matches_polyfit(pair):
+    mesh_p, mesh_q = pairs()[pair]
+    distance = np.sort(KDTreeDistance().compute(mesh_p, mesh_q))
+    candidates = distance[distance < SOFT_THRESHOLD]
+    assert find_threshold(candidates) == polyfit_threshold(candidates)
+
+def networkx_components(faces, face_mask):
+    nx = pytest.importorskip("networkx")
+    graph = nx.Graph()
+    vertex_faces = {}
+    for i in np.nonzero(face_mask)[0]:
+        v0, v1, v2 = faces[i]
+        graph.add_edges_from(((v0, v1), (v1, v2), (v2, v0)))
+        for v in faces[i]:
+            vertex_faces.setdefault(v, set()).add(int(i))
+    return {frozenset().union(*(vertex_faces[v] for v in component)) for component in nx.connected_components(graph)}
+
+@pytest.mark.parametrize("pair", range(len(CASES)+1))
+def test_face_components_match_networkx(pair):
+    mesh, _ = pairs()[pair]
+    faces = mesh.get_faces()
+    rng = np.random.default_rng(pair)
+    for face_mask in (np.ones(faces.shape[0], dtype=bool), rng.random(faces.shape[0]) < 0.3):
+        components = face_components(faces, face_mask, mesh.get_vertices().shape[0])
+        assert {frozenset(component.tolist()) for component in components} == networkx_components(faces, face_mask)
+        assert [component[0] for component in components] == sorted(component[0] for component in components)
+
+@pytest.mark.parametrize("search_radius", [None, SOFT_THRESHOLD])
+def test_centroid_engines_match_bruteforce(search_radius):
+    for mesh_p, mesh_q in pairs():
+        expected = BruteForceDistance(processes=2, search_radius=search_radius).compute(mesh_p, mesh_q)
+        for engine in (KDTreeDistance(search_radius=search_radius), TiledDistance(search_radius=search_radius)):
+            np.testing.assert_allclose(engine.compute(mesh_p, mesh_q), expected, rtol=1e-5, atol=1e-5)
+
+@pytest.mark.parametrize("search_radius", [None, SOFT_THRESHOLD])
+def test_surface_engine_matches_bruteforce(search_radius):
+    mesh_p, mesh_q = synthetic_pair()
+    centroids = mesh_p.get_centroids()
+    expected = np.array([np.amin(point_triangle_distance(np.broadcast_to(c, mesh_q.v0.shape), mesh_q.v0, mesh_q.v1, mesh_q.v2)) for c in centroids])
+    if search_radius is not None:
+        expected[expected > search_radius] = np.inf
+    distance = SurfaceDistance(search_radius=search_radius).compute(mesh_p, mesh_q)
+    np.testing.assert_allclose(distance, expected, rtol=1e-5, atol=1e-5)
+
+def test_pack_result_round_trip():
+    arrays = {"a": np.arange(7, dtype=np.int32), "b": np.linspace(0, 1, 12).reshape(3, 4), "empty": np.zeros((0, 3), dtype=np.float32)}
+    header, unpacked = unpack_result(pack_result({"name": "x"}, arrays))
+    assert header["name"] == "x"
+    assert list(unpacked) == list(arrays)
+    for name, array in arrays.items():
+        assert unpacked[name].dtype == array.dtype
+        np.testing.assert_array_equal(unpacked[name], array)
+
+@pytest.mark.parametrize("signed", [False, True])
+def test_result_file_round_trip(tmp_path, signed):
+    tumor, organ = case_meshes("17")
+    csa = ContactSurfaceArea(tumor, None, organ, None, signed=signed)
+    csa.compute()
+
+    path = str(tmp_path / "case.csa")
+    csa.save(path)
+    for loaded in (ContactSurfaceArea.load(path), ContactSurfaceArea.load(path, mmap=False), ContactSurfaceArea.from_bytes(csa.to_bytes())):
+        assert loaded.get_csa() == csa.get_csa()
+        assert loaded.get_threshold() == csa.get_threshold()
+        assert loaded.get_number_of_disconnected() == csa.get_number_of_disconnected()
+        assert loaded.get_metrics() == csa.get_metrics()
+        np.testing.assert_array_equal(loaded.get_distance(), csa.get_distance())
+        np.testing.assert_array_equal(loaded.contact_mask(), csa.contact_mask())
+        if signed:
+            assert loaded.get_penetration_area() == csa.get_penetration_area()
+            np.testing.assert_array_equal(loaded.get_inside(), csa.get_inside())